@@ -0,0 +1,116 @@
+"""Feed decoding benchmark.
+
+Validates the example feeds, optionally scaled up, with the
+``products.schemas`` models the same way ``celery_app.validate_feed``
+does::
+
+    python -m benchmarks.decode --scale 100 --runs 5
+
+``uncached`` parses every URL and date again like the validators used to,
+``cold`` runs start with empty URL and date caches, ``warm`` runs reuse
+the values cached by the previous run, like the next scheduled ingest
+of a worker.
+"""
+from argparse import ArgumentParser, Namespace
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from statistics import median
+from time import perf_counter
+
+import products.schemas
+from benchmarks.harness import scaled_feed
+from products.schemas import OnMainRootModel, RootModel
+
+MODES: tuple[str, ...] = ('uncached', 'cold', 'warm')
+
+
+@dataclass
+class DecodeResult:
+    mode: str
+    products: int
+    seconds: float
+
+    @property
+    def products_per_second(self) -> float:
+        return self.products / self.seconds if self.seconds else 0.0
+
+
+@contextmanager
+def uncached() -> Iterator[None]:
+    """Validators call the undecorated parsers while inside"""
+    check_url = products.schemas.check_url
+    parse_feed_date = products.schemas.parse_feed_date
+    products.schemas.check_url = check_url.__wrapped__
+    products.schemas.parse_feed_date = parse_feed_date.__wrapped__
+    try:
+        yield
+    finally:
+        products.schemas.check_url = check_url
+        products.schemas.parse_feed_date = parse_feed_date
+
+
+def clear_caches():
+    products.schemas.check_url.cache_clear()
+    products.schemas.parse_feed_date.cache_clear()
+
+
+def decode(feeds: dict[bool, bytes]) -> int:
+    return sum(
+        len((OnMainRootModel if on_main else RootModel).model_validate_json(
+            json_data=raw,
+            by_alias=True
+        ).products) for on_main, raw in feeds.items()
+    )
+
+
+def measure(feeds: dict[bool, bytes], mode: str, runs: int) -> DecodeResult:
+    """Median of ``runs`` decodes of ``feeds`` in ``mode``"""
+    context: AbstractContextManager = uncached() if mode == 'uncached' \
+        else nullcontext()
+    seconds: list[float] = []
+
+    clear_caches()
+    with context:
+        products_count: int = decode(feeds)
+
+        for _ in range(runs):
+            if mode == 'cold':
+                clear_caches()
+            start: float = perf_counter()
+            decode(feeds)
+            seconds.append(perf_counter() - start)
+
+    return DecodeResult(mode, products_count, median(seconds))
+
+
+def report(results: list[DecodeResult]):
+    baseline: float = results[0].seconds
+    print(f'{"mode":<8} {"products":>8} {"prod/s":>10} {"median, s":>9} '
+        f'{"speedup":>7}')
+
+    for result in results:
+        print(
+            f'{result.mode:<8} {result.products:>8} '
+            f'{result.products_per_second:>10.1f} {result.seconds:>9.4f} '
+            f'{baseline / result.seconds:>7.2f}'
+        )
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1,
+        help='copies of the example products under new ids')
+    parser.add_argument('--runs', type=int, default=5)
+    args: Namespace = parser.parse_args()
+
+    feeds: dict[bool, bytes] = {
+        on_main: scaled_feed(on_main, args.scale) for on_main in (True, False)
+    }
+
+    print(f'scale={args.scale} runs={args.runs}')
+    report([measure(feeds, mode, args.runs) for mode in MODES])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from json import dumps, load
+from pathlib import Path
+from resource import RUSAGE_SELF, getrusage
+from sys import platform
+from time import perf_counter
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.orm import Session
+
+from database import Base, enable_sqlite_foreign_keys, sync_session_maker
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+
+# on_main value -> example feed saved from the products API
+EXAMPLE_FEEDS: dict[bool, Path] = {
+    True: ROOT / 'example_raw_main_true.json',
+    False: ROOT / 'example_raw_main_false.json',
+}
+
+# Product-owned keys shifted by scaled copies, categories, marks and
+# tags stay shared like in the real catalog
+SCALED_ID_KEYS: frozenset[str] = frozenset((
+    'Product_ID',
+    'Color_ID',
+    'Image_ID',
+    'Parameter_ID',
+    'Photo_ID',
+    'Video_ID',
+    'Product_Extra_ID',
+    'id',
+    'product_id',
+    'color_id',
+    'parameter_id',
+))
+SHARED_KEYS: frozenset[str] = frozenset(('categories', 'marks', 'tags'))
+
+# Ids of copy ``n`` are shifted by ``n * SCALE_ID_STEP``
+SCALE_ID_STEP: int = 100_000
+
+
+def shift_ids(value: Any, offset: int) -> Any:
+    if isinstance(value, list):
+        return [shift_ids(item, offset) for item in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    shifted: dict[str, Any] = {}
+    for key, item in value.items():
+        if key in SHARED_KEYS:
+            shifted[key] = item
+        elif key in SCALED_ID_KEYS and isinstance(item, int):
+            shifted[key] = item + offset
+        else:
+            shifted[key] = shift_ids(item, offset)
+
+    return shifted
+
+
+def scaled_feed(on_main: bool, scale: int = 1) -> bytes:
+    """Example feed with its products repeated ``scale`` times under new
+    ids, encoded like the API answers"""
+    with EXAMPLE_FEEDS[on_main].open('rb') as file:
+        feed: dict[str, Any] = load(file)
+
+    products: list[dict[str, Any]] = feed['products']
+    feed['products'] = [
+        shift_ids(product, copy * SCALE_ID_STEP)
+        for copy in range(scale) for product in products
+    ]
+
+    return dumps(feed, ensure_ascii=False).encode()
+
+
+def bind_database(url: str, reset: bool = False) -> Engine:
+    """Point ``sync_session_maker`` at a scratch database, the configured
+    one is never touched by a benchmark"""
+    engine: Engine = create_engine(url=url)
+    if engine.dialect.name == 'sqlite':
+        enable_sqlite_foreign_keys(engine)
+
+    if reset:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    sync_session_maker.configure(bind=engine)
+
+    return engine
+
+
+class StatementCounter:
+    """Counts statements sent by ``engine``, executemany counts once"""
+
+    def __init__(self, engine: Engine):
+        self.count: int = 0
+        self._engine: Engine = engine
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def close(self):
+        event.remove(self._engine, 'before_cursor_execute', self._on_execute)
+
+
+class RowCounter:
+    """Rows and values returned by the SELECTs sent by ``engine``.
+
+    The statements are recorded during the measured run and sent again by
+    ``count_rows``, so fetching them twice never adds to the timings.
+    """
+
+    def __init__(self, engine: Engine):
+        self.statements: list[tuple[str, Any]] = []
+        self._engine: Engine = engine
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def close(self):
+        event.remove(self._engine, 'before_cursor_execute', self._on_execute)
+
+    def count_rows(self) -> tuple[int, int]:
+        rows: int = 0
+        values: int = 0
+        with self._engine.connect() as connection:
+            for statement, parameters in self.statements:
+                fetched: list = connection.exec_driver_sql(
+                    statement,
+                    parameters
+                ).fetchall()
+                rows += len(fetched)
+                values += sum(len(row) for row in fetched)
+        return rows, values
+
+
+class PhaseTimer:
+    """Wall time accumulated per named phase"""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += perf_counter() - start
+
+
+class CommitTimer:
+    """Time spent in ``Session.commit`` of every session, it is taken out
+    of the write phase and reported as its own one"""
+
+    def __init__(self):
+        self.seconds: float = 0.0
+        self._start: float = 0.0
+        event.listen(Session, 'before_commit', self._before_commit)
+        event.listen(Session, 'after_commit', self._after_commit)
+
+    def _before_commit(self, session: Session):
+        self._start = perf_counter()
+
+    def _after_commit(self, session: Session):
+        self.seconds += perf_counter() - self._start
+
+    def close(self):
+        event.remove(Session, 'before_commit', self._before_commit)
+        event.remove(Session, 'after_commit', self._after_commit)
+
+
+def peak_rss_mib() -> float:
+    """Peak resident set size of the process so far"""
+    max_rss: int = getrusage(RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return max_rss / (1 << 20) if platform == 'darwin' else max_rss / (1 << 10)
@@ -0,0 +1,123 @@
+"""/info rendering benchmark.
+
+Renders the same loaded pages of products the two ways ``/info`` can
+answer::
+
+    python -m benchmarks.render --scale 20 --count 3 --count 50
+
+``html`` converts every product with ``ProductView.from_orm(...).dict()``
+and renders ``all_info.html`` like ``/info``, ``json`` validates the rows
+and writes JSON in pydantic-core like ``/info.json``. The database is
+filled with the example feeds through the ingest first, pages are
+loaded once, only the rendering is timed.
+"""
+from argparse import ArgumentParser, Namespace
+from collections.abc import Callable
+from dataclasses import dataclass
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from benchmarks.harness import PhaseTimer, bind_database, scaled_feed
+from benchmarks.ingest import ingest
+from database import sync_session_maker
+from flask_app import app
+from products.blueprint import (
+    PRODUCT_VIEW_OPTIONS,
+    render_products_html,
+    render_products_json,
+)
+from products.models import Product
+
+RENDERERS: dict[str, Callable[[list[Product], str | None], str]] = {
+    'html': render_products_html,
+    'json': render_products_json,
+}
+
+
+@dataclass
+class RenderResult:
+    renderer: str
+    count: int
+    products: int
+    size: int
+    seconds: float
+
+
+def measure(
+    products: list[Product],
+    renderer: str,
+    count: int,
+    runs: int
+) -> RenderResult:
+    render: Callable[[list[Product], str | None], str] = RENDERERS[renderer]
+    page: list[Product] = products[:count]
+
+    with app.test_request_context():
+        body: str = render(page, None)
+
+        seconds: list[float] = []
+        for _ in range(runs):
+            start: float = perf_counter()
+            render(page, None)
+            seconds.append(perf_counter() - start)
+
+    return RenderResult(
+        renderer=renderer,
+        count=count,
+        products=len(page),
+        size=len(body.encode()),
+        seconds=median(seconds)
+    )
+
+
+def report(results: list[RenderResult]):
+    print(f'{"renderer":<8} {"count":>5} {"products":>8} {"bytes":>9} '
+        f'{"median, ms":>10} {"speedup":>7}')
+
+    baseline: dict[int, float] = {}
+    for result in results:
+        baseline.setdefault(result.count, result.seconds)
+        print(
+            f'{result.renderer:<8} {result.count:>5} {result.products:>8} '
+            f'{result.size:>9} {result.seconds * 1000:>10.2f} '
+            f'{baseline[result.count] / result.seconds:>7.2f}'
+        )
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db-url', default='sqlite:///./benchmark.db')
+    parser.add_argument('--scale', type=int, default=20,
+        help='copies of the example products under new ids')
+    parser.add_argument('--count', type=int, action='append',
+        help='products per page, can be repeated, 3 and 50 by default')
+    parser.add_argument('--runs', type=int, default=50)
+    args: Namespace = parser.parse_args()
+    counts: list[int] = args.count or [3, 50]
+
+    engine: Engine = bind_database(url=args.db_url, reset=True)
+    ingest(
+        {on_main: scaled_feed(on_main, args.scale) for on_main in (True, False)},
+        PhaseTimer()
+    )
+
+    with sync_session_maker() as session:
+        products: list[Product] = session.scalars(
+            select(Product).options(*PRODUCT_VIEW_OPTIONS)
+            .order_by(Product.id).limit(max(counts))
+        ).all()
+
+        print(f'scale={args.scale} runs={args.runs} db={args.db_url}')
+        report([
+            measure(products, renderer, count, args.runs)
+            for count in counts for renderer in RENDERERS
+        ])
+
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
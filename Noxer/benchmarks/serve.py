@@ -0,0 +1,109 @@
+"""HTTP throughput benchmark of a running server.
+
+Keeps ``--concurrency`` requests in flight against ``--url`` for
+``--seconds`` and reports requests per second and latency percentiles.
+Run it once against each serving mode of ``gunicorn_cfg.py``::
+
+    GUNICORN_MODE=wsgi gunicorn -c gunicorn_cfg.py
+    python -m benchmarks.serve --url 'http://127.0.0.1:8080/info?count=3' \\
+        --concurrency 1 --concurrency 16 --concurrency 64
+
+    GUNICORN_MODE=asgi gunicorn -c gunicorn_cfg.py
+    python -m benchmarks.serve --url 'http://127.0.0.1:8080/info?count=3' \\
+        --concurrency 1 --concurrency 16 --concurrency 64
+"""
+from argparse import ArgumentParser, Namespace
+from asyncio import TaskGroup, run
+from dataclasses import dataclass, field
+from statistics import quantiles
+from time import perf_counter
+
+from httpx import AsyncClient, HTTPError, Limits
+
+
+@dataclass
+class ServeResult:
+    concurrency: int
+    seconds: float
+    errors: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def requests_per_second(self) -> float:
+        return len(self.latencies) / self.seconds if self.seconds else 0.0
+
+    def percentile(self, percent: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return quantiles(self.latencies, n=100)[percent - 1]
+
+
+async def keep_requesting(
+    client: AsyncClient,
+    url: str,
+    deadline: float,
+    result: ServeResult
+):
+    while perf_counter() < deadline:
+        start: float = perf_counter()
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+        except HTTPError:
+            result.errors += 1
+            continue
+        result.latencies.append(perf_counter() - start)
+
+
+async def measure(url: str, concurrency: int, seconds: float) -> ServeResult:
+    async with AsyncClient(
+        limits=Limits(max_connections=concurrency),
+        timeout=60
+    ) as client:
+        # warm up the connections and the pools of the workers
+        for _ in range(concurrency):
+            await client.get(url)
+
+        start: float = perf_counter()
+        result: ServeResult = ServeResult(concurrency, seconds)
+        async with TaskGroup() as group:
+            for _ in range(concurrency):
+                group.create_task(
+                    keep_requesting(client, url, start + seconds, result)
+                )
+        result.seconds = perf_counter() - start
+
+    return result
+
+
+def report(results: list[ServeResult]):
+    print(f'{"conc":>4} {"requests":>8} {"errors":>6} {"req/s":>8} '
+        f'{"p50, ms":>8} {"p95, ms":>8} {"p99, ms":>8}')
+
+    for result in results:
+        print(
+            f'{result.concurrency:>4} {len(result.latencies):>8} '
+            f'{result.errors:>6} {result.requests_per_second:>8.1f} '
+            f'{result.percentile(50) * 1000:>8.1f} '
+            f'{result.percentile(95) * 1000:>8.1f} '
+            f'{result.percentile(99) * 1000:>8.1f}'
+        )
+
+
+def main():
+    parser: ArgumentParser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/info?count=3')
+    parser.add_argument('--concurrency', type=int, action='append',
+        help='requests in flight, can be repeated, 1, 16 and 64 by default')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args: Namespace = parser.parse_args()
+
+    print(f'url={args.url} seconds={args.seconds}')
+    report([
+        run(measure(args.url, concurrency, args.seconds))
+        for concurrency in args.concurrency or (1, 16, 64)
+    ])
+
+
+if __name__ == '__main__':
+    main()
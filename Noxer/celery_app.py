@@ -1,79 +1,272 @@
-from celery import Celery
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from celery import Celery, chord
 from celery.schedules import crontab
+from redis.exceptions import RedisError
 
 from products.schemas import OnMainRootModel, RootModel
+from products.schemas import Product as sc_Product
+from services.async_ingest import database_write_update_async
+from services.checkpoint import IngestCheckpoint, feed_fingerprint
+from services.feed_merge import merge_feeds, shard_products
+from services.fetcher import (
+    FetchedFeed,
+    fetch_merge_feeds,
+    iter_streamed_merge_feeds,
+    redis_client,
+    save_validators,
+)
+from services.ingest_stats import count, ingest_run, phase
+from services.payload_cache import (
+    load_cached_feeds,
+    mark_payload_written,
+    payload_unchanged,
+    store_payload,
+)
+from services.response_cache import CATALOG_GENERATION_KEY
 from services.services_celery import (
-    database_write_update_not_main,
+    database_delete_missing_products,
+    database_write_dictionaries,
     database_write_update_on_main,
+    database_write_update_products,
+    database_write_update_stream,
     prepare_celery_app,
-    request_get_products_main_false,
-    request_get_products_main_true,
 )
 from settings import cfg
 
 app: Celery = prepare_celery_app()
 
-@app.task
-def download_products_on_main_true():
+def commit_feeds(feeds: Iterable[FetchedFeed]):
+    """Remember the written feeds: validators for the next 304 and the
+    payload for the next content hash check"""
+    for feed in feeds:
+        save_validators(feed)
+        mark_payload_written(feed)
+
+def bump_catalog_generation():
+    """Must be called only after the ingest committed, /info responses
+    cached for an older generation stop being served"""
     try:
-        response_json_bytes: bytes = request_get_products_main_true()
-    except Exception as e:
-        app.logger.error(e)
+        redis_client().incr(CATALOG_GENERATION_KEY)
+    except RedisError as e:
+        app.logger.warning(f'Catalog generation not bumped: {e}')
+
+def validate_feed(feed: FetchedFeed) -> RootModel:
+    root_model_cls: type[RootModel] = OnMainRootModel if feed.on_main \
+        else RootModel
 
     try:
-        new: OnMainRootModel = OnMainRootModel.model_validate_json(
-            json_data=response_json_bytes,
+        return root_model_cls.model_validate_json(
+            json_data=feed.content,
             by_alias=True
         )
-
     except Exception as e:
         app.logger.error(e)
+        raise e
 
-    app.logger.info('JSON readed and finish validation')
+def ingest_streamed_feeds() -> bool:
+    streamed: list[FetchedFeed] = []
 
-    database_write_update_on_main(new)
+    def iter_chunks() -> Iterator[Iterator[bytes]]:
+        for feed in iter_streamed_merge_feeds():
+            streamed.append(feed)
+            yield feed.chunks
 
-    app.logger.info('All JSON\'s objects successful added')
+    if not database_write_update_stream(iter_chunks()):
+        return False
+
+    if not streamed:
+        app.logger.info('Feeds skipped, not modified')
+    else:
+        bump_catalog_generation()
+
+    commit_feeds(streamed)
+
+    app.logger.info('Streamed JSON\'s objects successful added')
 
     return True
 
+def ingest_async_feeds() -> bool:
+    streamed: list[FetchedFeed] | None = database_write_update_async()
+
+    if streamed is None:
+        return False
+
+    if not streamed:
+        app.logger.info('Feeds skipped, not modified')
+    else:
+        bump_catalog_generation()
+
+    commit_feeds(streamed)
+
+    app.logger.info('JSON\'s objects successful added by async pipeline')
+
+    return True
+
+@app.task
+def write_products_shard(products: list[dict[str, Any]]) -> bool:
+    with ingest_run('write_products_shard', app.logger.info):
+        return bool(database_write_update_products([
+            sc_Product.model_validate(product) for product in products
+        ]))
+
 @app.task
-def download_products_on_main_false():
+def finish_sharded_ingest(
+    results: list[bool],
+    feeds: list[dict[str, Any]],
+    product_ids: list[int]
+) -> bool:
+    """Chord callback, products gone from the feeds are deleted and feed
+    validators are saved only if every shard was written"""
+    if not all(results):
+        app.logger.error(
+            f'{results.count(False)} of {len(results)} shards failed, '
+            'feeds will be downloaded again on the next run'
+        )
+        return False
+
+    with ingest_run('finish_sharded_ingest', app.logger.info):
+        if not database_delete_missing_products(product_ids):
+            return False
+
+    bump_catalog_generation()
+
+    commit_feeds(FetchedFeed(**feed) for feed in feeds)
+
+    app.logger.info(
+        f'All JSON\'s objects successful added by {len(results)} shards'
+    )
+
+    return True
+
+def dispatch_shards(
+    merged: OnMainRootModel,
+    shards: list[list[sc_Product]],
+    feeds: list[FetchedFeed]
+) -> bool:
+    """Dictionaries are written here once, so shard tasks only read
+    them and never race on the same category, mark or tag"""
+    if not database_write_dictionaries(merged):
+        return False
+
+    chord(
+        write_products_shard.s([
+            product.model_dump(mode='json') for product in shard
+        ]) for shard in shards
+    )(finish_sharded_ingest.s(
+        feeds=[
+            {
+                'on_main': feed.on_main,
+                'url': feed.url,
+                'validators': feed.validators,
+                'content_hash': feed.content_hash
+            } for feed in feeds
+        ],
+        product_ids=[product.id for product in merged.products]
+    ))
+
+    app.logger.info(f'{len(merged.products)} products sent to {len(shards)} shards')
+
+    return True
+
+# a worker killed in the middle of a run gets the task redelivered, the
+# run resumes from its checkpoint
+@app.task(acks_late=True, reject_on_worker_lost=True)
+def download_products():
+    """Fetch on_main=true/false feeds, merge them and write in one pass"""
+    with ingest_run('download_products', app.logger.info):
+        return download_merged_products()
+
+def download_merged_products() -> bool:
+    if cfg.INGEST_ASYNC:
+        return ingest_async_feeds()
+
+    if cfg.INGEST_STREAMING:
+        return ingest_streamed_feeds()
+
     try:
-        response_json_bytes: bytes = request_get_products_main_false()
+        with phase('fetch'):
+            feeds: list[FetchedFeed] | None = fetch_merge_feeds()
     except Exception as e:
         app.logger.error(e)
         raise e
 
-    try:
-        new: RootModel = RootModel.model_validate_json(
-            json_data=response_json_bytes,
-            by_alias=True
+    if feeds is None:
+        app.logger.info('Feeds skipped, not modified')
+        return True
+
+    if all(payload_unchanged(feed) for feed in feeds):
+        app.logger.info('Feeds skipped, same content as the last written')
+        commit_feeds(feeds)
+        return True
+
+    for feed in feeds:
+        store_payload(feed)
+
+    return write_fetched_feeds(feeds)
+
+@app.task
+def replay_cached_products() -> bool:
+    """Write the payloads cached by the last run again, without the
+    products API"""
+    with ingest_run('replay_cached_products', app.logger.info):
+        feeds: list[FetchedFeed] | None = load_cached_feeds()
+        if feeds is None:
+            return False
+
+        return write_fetched_feeds(feeds)
+
+def write_fetched_feeds(feeds: list[FetchedFeed]) -> bool:
+    """Validate, merge and write downloaded feeds"""
+    with phase('validate'):
+        merged: OnMainRootModel = merge_feeds(
+            validate_feed(feed) for feed in feeds
         )
 
-    except Exception as e:
-        app.logger.error(e)
-        raise e
+    count('products_merged', len(merged.products))
+
+    if cfg.INGEST_SHARDS > 1:
+        shards: list[list[sc_Product]] = shard_products(
+            products=merged.products,
+            shards=cfg.INGEST_SHARDS,
+            min_size=cfg.INGEST_BATCH_SIZE
+        )
+
+        if len(shards) > 1:
+            return dispatch_shards(merged, shards, feeds)
+
+    checkpoint: IngestCheckpoint = IngestCheckpoint.resume(
+        feed_fingerprint(feeds)
+    )
+
+    if not database_write_update_on_main(
+        merged,
+        skip_batches=checkpoint.batches,
+        batch_written=checkpoint.batch_written
+    ):
+        return False
+
+    if not database_delete_missing_products(
+        [product.id for product in merged.products]
+    ):
+        return False
 
+    bump_catalog_generation()
 
-    app.logger.info('JSON readed and finish validation')
+    commit_feeds(feeds)
 
-    database_write_update_not_main(new)
+    checkpoint.finish()
 
     app.logger.info('All JSON\'s objects successful added')
 
     return True
 
 app.conf.beat_schedule = {
-    'download_products_on_main_true': {
-        'task': 'celery_app.download_products_on_main_true',
+    'download_products': {
+        'task': 'celery_app.download_products',
         'schedule': crontab(hour=cfg.UPDATE_HOURS),
-    },
-    'download_products_on_main_false': {
-        'task': 'celery_app.download_products_on_main_false',
-        'schedule': crontab(hour=(cfg.UPDATE_HOURS)),
     }
 }
 
-download_products_on_main_true.delay()
-download_products_on_main_false.delay()
+download_products.delay()
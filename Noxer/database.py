@@ -1,5 +1,6 @@
 from collections.abc import AsyncGenerator, Generator
 
+from sqlalchemy import event
 from sqlalchemy.engine import Engine, create_engine
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -9,13 +10,23 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 
-from settings import cfg
+from settings import DatabaseType, cfg
 
 
 class Base(DeclarativeBase):
     pass
 
 
+def enable_sqlite_foreign_keys(engine: Engine):
+    """SQLite ignores foreign keys, ON DELETE CASCADE included, unless
+    every connection turns them on"""
+    @event.listens_for(engine, 'connect')
+    def set_foreign_keys_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 sync_engine: Engine = create_engine(
     url = cfg.DATABASE_URL_SYNC_ENGINE
 )
@@ -32,6 +43,10 @@ async_session_maker: async_sessionmaker = async_sessionmaker(
     expire_on_commit=False
 )
 
+if cfg.DB_TYPE == DatabaseType.SQLITE:
+    enable_sqlite_foreign_keys(sync_engine)
+    enable_sqlite_foreign_keys(async_engine.sync_engine)
+
 def get_sync_session() -> Generator[Session]:
     with sync_session_maker as session:
         yield session
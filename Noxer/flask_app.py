@@ -1,8 +1,23 @@
 from products.blueprint import products_bp
+from services.asgi import TunnedAsgi
 from services.tunned_flask import TunnedFlask
+from settings import cfg
 
 app: TunnedFlask = TunnedFlask(
     import_name = __name__
 )
 
 app.register_blueprint(blueprint=products_bp)
+
+# uvicorn workers serve this one (GUNICORN_MODE=asgi)
+asgi_app: TunnedAsgi = TunnedAsgi(app)
+
+
+def get_pool_status() -> dict:
+    """Connection pool of the worker that answered"""
+    return app.pool_status()
+
+
+# pool counters are internals, off the public catalog unless asked for
+if cfg.DB_POOL_STATUS:
+    app.add_url_rule('/pool', view_func=get_pool_status)
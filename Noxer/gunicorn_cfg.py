@@ -8,6 +8,26 @@ threads = int(os.environ.get('GUNICORN_THREADS', '4'))
 
 bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
 
+# "wsgi": threaded workers, "asgi": uvicorn workers, one event loop per
+# worker serves all its requests (ASGI_THREADS of them at once)
+mode = os.environ.get('GUNICORN_MODE', 'wsgi')
 
+if mode == 'asgi':
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    wsgi_app = 'flask_app:asgi_app'
+else:
+    wsgi_app = 'flask_app:app'
 
 forwarded_allow_ips = '*'
+
+
+def post_worker_init(worker):
+    # one async engine and connection pool per worker, never the master's,
+    # an ASGI worker creates it on lifespan startup on its own loop
+    if mode != 'asgi':
+        worker.wsgi.start_database()
+
+
+def worker_exit(server, worker):
+    if mode != 'asgi' and hasattr(worker, 'wsgi'):
+        worker.wsgi.stop_database()
@@ -0,0 +1,30 @@
+"""Product content hash
+
+Revision ID: b7e41c2a9d03
+Revises: 6093512c7d54
+Create Date: 2026-10-18 12:10:41.208113
+
+"""
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41c2a9d03'
+down_revision: str | Sequence[str] | None = '6093512c7d54'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'products',
+        sa.Column('content_hash', sa.String(length=64), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('products', 'content_hash')
@@ -0,0 +1,70 @@
+"""Product children ON DELETE CASCADE
+
+Revision ID: 4f2d8c61a5e7
+Revises: b7e41c2a9d03
+Create Date: 2026-10-18 21:02:17.534806
+
+"""
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4f2d8c61a5e7'
+down_revision: str | Sequence[str] | None = 'b7e41c2a9d03'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+PRODUCT_CHILD_TABLES: tuple[str, ...] = (
+    'colors',
+    'excluded_items',
+    'extras',
+    'images',
+    'importance_nums',
+    'parameters',
+    'review_videos',
+    'reviews',
+)
+
+# Names SQLite's unnamed foreign keys get in batch mode
+NAMING_CONVENTION: dict[str, str] = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+
+
+def product_foreign_key_name(table_name: str) -> str:
+    """Name the database gave to the init migration's unnamed key"""
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table_name):
+        if foreign_key['constrained_columns'] == ['product_id'] and \
+                foreign_key['name']:
+            return foreign_key['name']
+    return f'fk_{table_name}_product_id_products'
+
+
+def replace_product_foreign_keys(ondelete: str | None) -> None:
+    for table_name in PRODUCT_CHILD_TABLES:
+        name: str = product_foreign_key_name(table_name)
+
+        with op.batch_alter_table(
+            table_name,
+            naming_convention=NAMING_CONVENTION
+        ) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(
+                name,
+                'products',
+                ['product_id'],
+                ['id'],
+                ondelete=ondelete
+            )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    replace_product_foreign_keys(ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    replace_product_foreign_keys(ondelete=None)
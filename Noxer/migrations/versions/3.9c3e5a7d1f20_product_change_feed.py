@@ -0,0 +1,55 @@
+"""Product change feed
+
+Revision ID: 9c3e5a7d1f20
+Revises: 4f2d8c61a5e7
+Create Date: 2026-10-18 22:14:05.118342
+
+"""
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e5a7d1f20'
+down_revision: str | Sequence[str] | None = '4f2d8c61a5e7'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_changes',
+    sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('deleted', sa.Boolean(), nullable=False),
+    sa.Column(
+        'changed_at',
+        sa.DateTime(timezone=True),
+        server_default=sa.func.now(),
+        nullable=False
+    ),
+    sa.PrimaryKeyConstraint('seq'),
+    sqlite_autoincrement=True
+    )
+    op.create_index(
+        op.f('ix_product_changes_product_id'),
+        'product_changes',
+        ['product_id'],
+        unique=False
+    )
+
+    # products stored before the feed existed are its first changes
+    op.execute(
+        'INSERT INTO product_changes (product_id, deleted) '
+        'SELECT id, false FROM products ORDER BY id'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        op.f('ix_product_changes_product_id'),
+        table_name='product_changes'
+    )
+    op.drop_table('product_changes')
@@ -1,70 +1,301 @@
-from flask import Blueprint, current_app, render_template, request
-from sqlalchemy import (
-    ChunkedIteratorResult,
-    Select,
-    select,
+from collections.abc import Callable
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    render_template,
+    request,
+    url_for,
 )
-from sqlalchemy.orm import aliased, joinedload
-from sqlalchemy.orm.util import AliasedClass
+from redis.exceptions import RedisError
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Load, selectinload
 
-from products.models import Category, Product, Tag
-from products.schemas import ProductView
+from products.models import Category, Product, ProductChange, Tag
+from products.schemas import ProductsPage, ProductView
+from services.response_cache import (
+    CachedResponse,
+    load_response,
+    response_etag,
+    response_key,
+    save_response,
+)
 
+# No url_prefix: Flask would put /info.json under /info/
 products_bp: Blueprint = Blueprint(
     name = 'products',
-    import_name = __name__,
-    url_prefix = '/info'
+    import_name = __name__
 )
 
-@products_bp.route("")
-async def get_products_texted():
-    page = request.args.get('page', 1, type=int)
-    count = request.args.get('count', 3, type=int)
-    category_names = request.args.getlist('category_names', type=str)
-    tags_ids = request.args.getlist('tags', type=int)
+# Relationships rendered by ProductView. Each one is loaded by its own
+# SELECT ... WHERE product_id IN (page ids): joined eager loading would
+# return colors x images x parameters x ... rows for every product.
+PRODUCT_VIEW_OPTIONS: tuple[Load, ...] = (
+    selectinload(Product.categories),
+    selectinload(Product.marks),
+    selectinload(Product.colors),
+    selectinload(Product.excluded),
+    selectinload(Product.images),
+    selectinload(Product.importance_num),
+    selectinload(Product.parameters),
+    selectinload(Product.extras),
+    selectinload(Product.reviews),
+    selectinload(Product.reviews_video),
+    selectinload(Product.tags),
+)
+
+# Largest page of /info/changes
+CHANGES_MAX_COUNT: int = 1000
+
+HTML_MIMETYPE: str = 'text/html'
+JSON_MIMETYPE: str = 'application/json'
+
+# Formats of /info, HTML wins when the client accepts both equally
+PAGE_MIMETYPES: tuple[str, ...] = (HTML_MIMETYPE, JSON_MIMETYPE)
+
+async def load_cached_response(key: str) -> tuple[str | None, str | None]:
+    """Catalog generation and the response cached for it, ``None`` for
+    the generation if the cache is off or unavailable"""
+    if current_app.redis is None:
+        return None, None
+
+    try:
+        return await load_response(current_app.redis, key)
+    except RedisError as e:
+        current_app.logger.warning(f'Cached response not loaded: {e}')
+        return None, None
+
 
+async def save_cached_response(key: str, generation: str | None, body: str):
+    if current_app.redis is None or generation is None:
+        return
+
+    try:
+        await save_response(current_app.redis, key, generation, body)
+    except RedisError as e:
+        current_app.logger.warning(f'Response not cached: {e}')
+
+
+def render_products_html(
+    products_orm: list[Product],
+    next_url: str | None
+) -> str:
+    products_sc: ProductView = [
+        ProductView.from_orm(product) for product in products_orm
+    ]
+
+    return render_template(
+        'all_info.html',
+        title='All information',
+        products=[product_sc.dict() for product_sc in products_sc],
+        next_url=next_url
+    )
+
+
+def render_products_json(
+    products_orm: list[Product],
+    next_url: str | None
+) -> str:
+    # pydantic-core validates the rows and writes JSON itself, no dicts
+    # and no template in between
+    return ProductsPage(products=products_orm, next_url=next_url) \
+        .model_dump_json()
+
+
+async def render_products_page(
+    endpoint: str,
+    render: Callable[[list[Product], str | None], str],
+    page: int,
+    count: int,
+    after: int | None,
+    category_names: list[str],
+    tags_ids: list[int]
+) -> str:
     async with current_app.get_async_session() as session:
-        stmt: Select = select(Product).options(
-            joinedload(Product.categories),
-            joinedload(Product.marks),
-            joinedload(Product.colors),
-            joinedload(Product.excluded),
-            joinedload(Product.images),
-            joinedload(Product.importance_num),
-            joinedload(Product.parameters),
-            joinedload(Product.extras),
-            joinedload(Product.reviews),
-            joinedload(Product.reviews_video),
-            joinedload(Product.tags)
-        )
+        # ids first: filters and LIMIT count products, never joined rows
+        ids_stmt: Select = select(Product.id).order_by(Product.id)
 
-        if category_names:
-            for category_name in category_names:
-                category_alias: AliasedClass = aliased(Category, name=category_name)
-                stmt = stmt.join(
-                    Product.categories.of_type(category_alias),
-                    isouter=False
-                ).where(category_alias.name == category_name)
+        for category_name in category_names:
+            ids_stmt = ids_stmt.where(
+                Product.categories.any(Category.name == category_name)
+            )
 
         if tags_ids:
-            stmt = stmt.where(
+            ids_stmt = ids_stmt.where(
                 Product.tags.any(
                     Tag.id.in_(tags_ids)
                 )
             )
 
-        stmt = stmt.offset((page-1)*count).limit(count)
+        if after is not None:
+            ids_stmt = ids_stmt.where(Product.id > after)
+        else:
+            ids_stmt = ids_stmt.offset((page-1)*count)
 
-        result: ChunkedIteratorResult = await session.execute(stmt)
+        product_ids: list[int] = (
+            await session.scalars(ids_stmt.limit(count))
+        ).all()
 
-        products_orm: list[Product] = result.scalars().unique().all()
+        products_orm: list[Product] = []
+        if product_ids:
+            products_orm = (await session.scalars(
+                select(Product).options(*PRODUCT_VIEW_OPTIONS).where(
+                    Product.id.in_(product_ids)
+                ).order_by(Product.id)
+            )).all()
 
-        products_sc: ProductView = [
-            ProductView.from_orm(product) for product in products_orm
-        ]
+        next_url: str | None = None
+        if product_ids and len(product_ids) == count:
+            next_url = url_for(
+                endpoint,
+                after=product_ids[-1],
+                count=count,
+                category_names=category_names,
+                tags=tags_ids
+            )
 
-        return render_template(
-            'all_info.html',
-            title='All information',
-            products=[product_sc.dict() for product_sc in products_sc]
+        return render(products_orm, next_url)
+
+async def products_page_response(
+    endpoint: str,
+    render: Callable[[list[Product], str | None], str],
+    mimetype: str
+) -> Response:
+    """Page of products ordered by id, rendered by ``render``.
+
+    ``after`` is the keyset cursor: the page starts right after this id,
+    so any page costs as much as the first one. ``page`` still works as
+    an offset for old links.
+
+    Pages are cached in Redis until the next ingest bumps the catalog
+    generation and for a few seconds in the worker itself. The ETag
+    is made of the generation and the arguments, a matching
+    ``If-None-Match`` gets 304 Not Modified.
+    """
+    page = request.args.get('page', 1, type=int)
+    count = request.args.get('count', 3, type=int)
+    after = request.args.get('after', type=int)
+    if page < 1 or count < 1:
+        abort(400)
+    # order and repeats of the filters never change the page
+    category_names = sorted(set(request.args.getlist('category_names', type=str)))
+    tags_ids = sorted(set(request.args.getlist('tags', type=int)))
+    if after is not None:
+        page = 1
+
+    key: str = response_key(endpoint, [
+        ('page', page),
+        ('count', count),
+        ('after', after),
+        *(('category_names', name) for name in category_names),
+        *(('tags', tag_id) for tag_id in tags_ids),
+    ])
+
+    cached: CachedResponse | None = current_app.response_cache.get(key)
+    if cached is None:
+        generation, body = await load_cached_response(key)
+        if body is None:
+            body = await render_products_page(
+                endpoint,
+                render,
+                page,
+                count,
+                after,
+                category_names,
+                tags_ids
+            )
+            await save_cached_response(key, generation, body)
+
+        cached = CachedResponse(
+            etag=response_etag(key, generation, body),
+            body=body
+        )
+        current_app.response_cache.put(key, cached)
+
+    response: Response = current_app.response_class(
+        cached.body,
+        mimetype=mimetype
+    )
+    response.set_etag(cached.etag)
+    # caches keep the page but ask whether it is still current
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+@products_bp.route("/info")
+async def get_products_texted():
+    """HTML page of products, JSON for ``Accept: application/json``"""
+    if request.accept_mimetypes.best_match(PAGE_MIMETYPES) == JSON_MIMETYPE:
+        response: Response = await get_products_json()
+    else:
+        response = await products_page_response(
+            'products.get_products_texted',
+            render_products_html,
+            HTML_MIMETYPE
         )
+
+    # the same URL answers both formats
+    response.vary.add('Accept')
+    return response
+
+@products_bp.route("/info.json")
+async def get_products_json():
+    """Page of products in JSON: ``products`` and ``next_url``"""
+    return await products_page_response(
+        'products.get_products_json',
+        render_products_json,
+        JSON_MIMETYPE
+    )
+
+@products_bp.route("/info/changes")
+async def get_products_changes():
+    """Products created, updated or deleted after the ``since`` token.
+
+    Returns the current version of every changed product, ids of the
+    deleted ones and the token for the next poll. ``more`` is set when
+    the ``count`` limit cut the changes, poll again with the new token.
+    """
+    since = request.args.get('since', 0, type=int)
+    count = request.args.get('count', 100, type=int)
+    if since < 0 or count < 1:
+        abort(400)
+    count = min(count, CHANGES_MAX_COUNT)
+
+    async with current_app.get_async_session() as session:
+        changes: list[ProductChange] = (await session.scalars(
+            select(ProductChange).where(
+                ProductChange.seq > since
+            ).order_by(ProductChange.seq).limit(count)
+        )).all()
+
+        # only the last change of a product counts
+        deleted: dict[int, bool] = {
+            change.product_id: change.deleted for change in changes
+        }
+        changed_ids: list[int] = [
+            product_id for product_id, is_deleted in deleted.items()
+            if not is_deleted
+        ]
+
+        products_orm: list[Product] = []
+        if changed_ids:
+            products_orm = (await session.scalars(
+                select(Product).options(*PRODUCT_VIEW_OPTIONS).where(
+                    Product.id.in_(changed_ids)
+                ).order_by(Product.id)
+            )).unique().all()
+
+        return {
+            'token': changes[-1].seq if changes else since,
+            'more': len(changes) == count,
+            'products': [
+                ProductView.model_validate(product).model_dump(mode='json')
+                for product in products_orm
+            ],
+            'deleted': sorted(
+                product_id for product_id, is_deleted in deleted.items()
+                if is_deleted
+            ),
+        }
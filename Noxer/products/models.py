@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, Float, ForeignKey, String, Text
+from sqlalchemy import DateTime, Float, ForeignKey, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database import Base
@@ -97,7 +97,10 @@ class Color(Base):
     json_data: Mapped[str | None] = mapped_column(Text, nullable=True)
     sort_order: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="colors",
         uselist=False
@@ -113,7 +116,10 @@ class Extra(Base):
     offer: Mapped[str] = mapped_column(Text)
     ai_description: Mapped[str | None] = mapped_column(Text, nullable=True)
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="extras",
         uselist=False
@@ -129,7 +135,10 @@ class Image(Base):
     sort_order: Mapped[int | None]
     title: Mapped[str | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="images",
         uselist=False,
@@ -149,7 +158,10 @@ class Parameter(Base):
     price: Mapped[float] = mapped_column(Float)
     sort_order: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="parameters",
         uselist=False
@@ -162,7 +174,10 @@ class Review(Base):
     image_url: Mapped[str]
     sort_order: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="reviews",
         uselist=False
@@ -176,7 +191,10 @@ class ReviewVideo(Base):
     video_url: Mapped[str | None]
     sort_order: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="reviews_video",
         uselist=False
@@ -189,7 +207,10 @@ class ExcludedItem(Base):
     color_id: Mapped[int | None]
     parameter_id: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="excluded",
         uselist=False
@@ -201,7 +222,10 @@ class ImportanceNum(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     importance: Mapped[int | None]
 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))
+    product_id: Mapped[int] = mapped_column(ForeignKey(
+        'products.id',
+        ondelete="CASCADE"
+    ))
     product: Mapped["Product"] = relationship(
         back_populates="importance_num",
         uselist=False
@@ -222,6 +246,11 @@ class Product(Base):
         Text,
         nullable=True
     )
+    # sha256 of the validated feed entry, see schemas.Product.content_hash
+    content_hash: Mapped[str | None] = mapped_column(
+        String(64),
+        nullable=True
+    )
 
     # Relationships
     categories: Mapped[list["Category"]] = relationship(
@@ -232,27 +261,32 @@ class Product(Base):
     colors: Mapped[list["Color"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     excluded: Mapped[list["ExcludedItem"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     extras: Mapped[list["Extra"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     images: Mapped[list["Image"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     importance_num: Mapped[list["ImportanceNum"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     marks: Mapped[list["ProductMark"]] = relationship(
         secondary="product_mark_association",
@@ -262,20 +296,40 @@ class Product(Base):
     parameters: Mapped[list["Parameter"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     reviews: Mapped[list["Review"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     reviews_video: Mapped[list["ReviewVideo"]] = relationship(
         back_populates="product",
         uselist=True,
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     tags: Mapped[list["Tag"]] = relationship(
         secondary="product_tag_association",
         back_populates="products",
         uselist=True,
     )
+
+
+class ProductChange(Base):
+    """Change feed of the catalog, a row per created, updated or deleted
+    product in the order the ingest committed them"""
+    __tablename__ = 'product_changes'
+    # SQLite would hand out the rowid of a removed last row again
+    __table_args__ = ({'sqlite_autoincrement': True}, )
+
+    seq: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # no foreign key, deleted products keep their changes
+    product_id: Mapped[int] = mapped_column(index=True)
+    deleted: Mapped[bool] = mapped_column(default=False)
+    changed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
@@ -1,4 +1,6 @@
 from datetime import UTC, datetime
+from functools import cached_property, lru_cache
+from hashlib import sha256
 
 from pydantic import (
     AliasChoices,
@@ -12,6 +14,27 @@ from pydantic import (
 
 http_url_ta: TypeAdapter = TypeAdapter(HttpUrl)
 
+# Feed dates, as the products API formats them
+FEED_DATE_FORMAT: str = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+# Feeds repeat the same URLs and dates a lot: category images, shared
+# posters, products updated together. A value is parsed once per process.
+@lru_cache(maxsize=16384)
+def check_url(value: str) -> str:
+    http_url_ta.validate_python(value)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def parse_feed_date(value: str) -> datetime | str:
+    try:
+        dt = datetime.strptime(value, FEED_DATE_FORMAT)
+    except ValueError:
+        # ISO 8601 of a product serialized by model_dump(mode='json')
+        return value
+    return dt.replace(tzinfo=UTC)
+
 
 class ORMBaseModel(BaseModel):
     model_config = ConfigDict(
@@ -30,7 +53,7 @@ class ORMBaseModel(BaseModel):
     )
     def parse_url(cls, value):
         if isinstance(value, str):
-            http_url_ta.validate_python(value)
+            check_url(value)
         return value
 
 
@@ -147,13 +170,22 @@ class Product(ORMBaseModel):
     @field_validator('created_at', 'updated_at', mode='before')
     def parse_dates(cls, value):
         if isinstance(value, str):
-            dt = datetime.strptime(value, '%a, %d %b %Y %H:%M:%S GMT')
-            return dt.replace(tzinfo=UTC)
+            return parse_feed_date(value)
         return value
 
+    # feed models are never changed after validation, so the product is
+    # dumped once however many writers and filters need its hash
+    @cached_property
+    def content_hash(self) -> str:
+        return sha256(self.model_dump_json().encode()).hexdigest()
+
 class ProductView(Product):
     tags: list[Tags]
 
+class ProductsPage(ORMBaseModel):
+    products: list[ProductView]
+    next_url: str | None = None
+
 class OnlyProductsList(ORMBaseModel):
     products: list[Product]
 
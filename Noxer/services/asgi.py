@@ -0,0 +1,36 @@
+from asyncio import get_running_loop
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.asgi_typing import Receive, Scope, Send
+
+from services.tunned_flask import TunnedFlask
+from settings import cfg
+
+
+class TunnedAsgi:
+    """ASGI entry of a TunnedFlask app for uvicorn workers.
+
+    Flask stays a WSGI app, a2wsgi runs each request in a thread of its
+    own, but the async views and the pooled async engine of the worker
+    live on the server event loop, which multiplexes the database I/O
+    of all the requests in flight.
+    """
+
+    def __init__(self, app: TunnedFlask, threads: int = cfg.ASGI_THREADS):
+        self.app: TunnedFlask = app
+        self.wsgi: WSGIMiddleware = WSGIMiddleware(app, workers=threads)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'lifespan':
+            await self.wsgi(scope, receive, send)
+            return
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.app.start_database(get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.app.dispose_database()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,252 @@
+from asyncio import (
+    AbstractEventLoop,
+    Queue,
+    QueueFull,
+    Task,
+    TaskGroup,
+    create_task,
+    gather,
+    get_running_loop,
+    run,
+    run_coroutine_threadsafe,
+    to_thread,
+    wait,
+)
+from collections.abc import Coroutine, Iterator
+from contextlib import suppress
+from dataclasses import dataclass, field
+from threading import Event
+from typing import Any
+
+from httpx import AsyncClient
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from database import async_engine, async_session_maker
+from products.schemas import Category as sc_Category
+from products.schemas import Product as sc_Product
+from products.schemas import ProductMark as sc_ProductMark
+from services.bulk_upsert import write_dictionaries
+from services.dictionary_cache import DictionaryCache
+from services.feed_merge import ProductDeduplicator
+from services.fetcher import (
+    FEEDS_ON_MAIN,
+    FetchedFeed,
+    aiter_streamed_merge_feeds,
+    client_options,
+    feeds_headers,
+)
+from services.services_celery import (
+    BatchWriter,
+    batch_writer,
+    iter_stream_entities,
+    logger,
+    remove_missing_products,
+    write_batch,
+)
+from settings import cfg
+
+# Body chunks buffered between the download and the parser thread
+CHUNKS_BUFFERED: int = 16
+
+# How often a parser thread blocked on a queue checks for a stop
+STOP_POLL_SECONDS: float = 0.1
+
+# Put after the last chunk of every feed, ``None`` follows the last feed
+FEED_END: object = object()
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class LoopBridge:
+    """Runs queue operations of the event loop from the parser thread.
+
+    A blocked call gives up once the pipeline is stopped, so a failed
+    download or write never leaves the thread hanging.
+    """
+
+    def __init__(self, loop: AbstractEventLoop):
+        self.loop: AbstractEventLoop = loop
+        self.stopped: Event = Event()
+
+    def call(self, coroutine: Coroutine) -> Any:
+        future = run_coroutine_threadsafe(coroutine, self.loop)
+        while True:
+            try:
+                return future.result(timeout=STOP_POLL_SECONDS)
+            except TimeoutError:
+                if self.stopped.is_set():
+                    future.cancel()
+                    raise PipelineStopped from None
+
+
+@dataclass
+class IngestBatch:
+    products: list[sc_Product] = field(default_factory=list)
+    categories: list[sc_Category] = field(default_factory=list)
+    product_marks: list[sc_ProductMark] = field(default_factory=list)
+
+
+async def download_feeds(
+    chunks: Queue,
+    streamed: list[FetchedFeed],
+    headers: dict[bool, dict[str, str]]
+):
+    async with AsyncClient(**client_options()) as client:
+        async for feed in aiter_streamed_merge_feeds(client, headers):
+            streamed.append(feed)
+            async for chunk in feed.chunks:
+                await chunks.put(chunk)
+            await chunks.put(FEED_END)
+
+    await chunks.put(None)
+
+
+def iter_feed_chunks(
+    first: bytes | object,
+    chunks: Queue,
+    bridge: LoopBridge
+) -> Iterator[bytes]:
+    chunk: bytes | object = first
+    while chunk is not FEED_END:
+        yield chunk
+        chunk = bridge.call(chunks.get())
+
+
+def iter_queued_feeds(chunks: Queue, bridge: LoopBridge) -> Iterator[Iterator[bytes]]:
+    while (chunk := bridge.call(chunks.get())) is not None:
+        feed_chunks: Iterator[bytes] = iter_feed_chunks(chunk, chunks, bridge)
+        yield feed_chunks
+        # the parser stops at the closing brace, skip the rest of the feed
+        for _ in feed_chunks:
+            pass
+
+
+def parse_feeds(
+    chunks: Queue,
+    batches: Queue,
+    bridge: LoopBridge,
+    deduplicator: ProductDeduplicator,
+    feed_ids: set[int]
+):
+    """Parser thread: validates queued chunks into batches for the writer,
+    the event loop stays free for the network and the database"""
+    for feed_chunks in iter_queued_feeds(chunks, bridge):
+        products: list[sc_Product] = []
+
+        for key, value in iter_stream_entities(feed_chunks, deduplicator, feed_ids):
+            if key != 'products':
+                bridge.call(batches.put(IngestBatch(**{key: value})))
+                continue
+
+            products.append(value)
+            if len(products) == cfg.INGEST_BATCH_SIZE:
+                bridge.call(batches.put(IngestBatch(products=products)))
+                products = []
+
+        if products:
+            bridge.call(batches.put(IngestBatch(products=products)))
+
+    bridge.call(batches.put(None))
+
+
+def write_ingest_batch(
+    session: Session,
+    batch: IngestBatch,
+    write: BatchWriter,
+    cache: DictionaryCache
+):
+    write_dictionaries(session, batch.categories, batch.product_marks, cache)
+
+    if batch.products:
+        write_batch(session, batch.products, write, cache)
+
+    # a batch of unchanged products leaves its dictionaries uncommitted
+    session.commit()
+
+
+async def write_batches(batches: Queue, feed_ids: set[int], stopped: Event):
+    """Writer task, never cancelled: a failed pipeline sets ``stopped``
+    and the writer leaves between two batches with its session closed"""
+    async with async_session_maker() as session:
+        cache: DictionaryCache = await session.run_sync(DictionaryCache.preload)
+        write: BatchWriter = await session.run_sync(batch_writer)
+
+        while True:
+            batch: IngestBatch | None = await batches.get()
+            if stopped.is_set():
+                raise PipelineStopped
+            if batch is None:
+                break
+            await session.run_sync(write_ingest_batch, batch, write, cache)
+
+        await session.run_sync(remove_missing_products, feed_ids)
+
+
+async def join_writer(writer: Task):
+    """Raises what the writer raised, cancelling the join leaves the
+    writer running"""
+    await wait((writer, ))
+    writer.result()
+
+
+async def ingest_feeds_async(
+    headers: dict[bool, dict[str, str]]
+) -> list[FetchedFeed]:
+    """Download, validate and write the merged feeds in a bounded pipeline.
+
+    The download, a parser thread and the writer run at once, so the
+    next batch is fetched and validated while the previous one is being
+    written. ``cfg.INGEST_PIPELINE_DEPTH`` batches at most wait for the
+    writer. ``headers`` of the requests come from ``feeds_headers``.
+    Returns the feeds that were written.
+    """
+    chunks: Queue = Queue(maxsize=CHUNKS_BUFFERED)
+    batches: Queue = Queue(maxsize=cfg.INGEST_PIPELINE_DEPTH)
+    bridge: LoopBridge = LoopBridge(get_running_loop())
+    feed_ids: set[int] = set()
+    streamed: list[FetchedFeed] = []
+
+    writer: Task = create_task(write_batches(batches, feed_ids, bridge.stopped))
+
+    try:
+        async with TaskGroup() as group:
+            group.create_task(download_feeds(chunks, streamed, headers))
+            group.create_task(to_thread(
+                parse_feeds,
+                chunks,
+                batches,
+                bridge,
+                ProductDeduplicator(),
+                feed_ids
+            ))
+            # a failed writer stops the download, but a failed download
+            # must not cancel the writer in the middle of a statement
+            group.create_task(join_writer(writer))
+    except BaseException:
+        bridge.stopped.set()
+        # wake the writer up if it waits for a batch
+        with suppress(QueueFull):
+            batches.put_nowait(None)
+        await gather(writer, return_exceptions=True)
+        raise
+    finally:
+        bridge.stopped.set()
+        # dispose() cannot close a connection the writer still holds
+        if isinstance(async_engine.pool, QueuePool) and \
+                async_engine.pool.checkedout():
+            logger.error(
+                f'{async_engine.pool.checkedout()} connections still '
+                'checked out after the async pipeline'
+            )
+        # connections are bound to this event loop
+        await async_engine.dispose()
+
+    return streamed
+
+
+@logger.catch
+def database_write_update_async() -> list[FetchedFeed] | None:
+    return run(ingest_feeds_async(feeds_headers(*FEEDS_ON_MAIN)))
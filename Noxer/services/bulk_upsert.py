@@ -0,0 +1,570 @@
+from collections.abc import Callable, Collection, Iterable
+from dataclasses import dataclass, field
+from sqlite3 import sqlite_version_info
+from typing import Any
+
+from sqlalchemy import Insert, Select, delete, insert, select, tuple_, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import Base
+from products.models import (
+    Category,
+    Color,
+    ExcludedItem,
+    Extra,
+    Image,
+    ImportanceNum,
+    Parameter,
+    Product,
+    ProductCategoryAssociation,
+    ProductMark,
+    ProductMarkAssociation,
+    ProductTagAssociation,
+    Review,
+    ReviewVideo,
+    Tag,
+)
+from products.schemas import Category as sc_Category
+from products.schemas import Product as sc_Product
+from products.schemas import ProductMark as sc_ProductMark
+from services.change_feed import record_product_changes
+from services.dictionary_cache import DictionaryCache
+from settings import DatabaseType
+
+Row = dict[str, Any]
+
+# Product attribute name -> one-to-many child table
+PRODUCT_CHILD_TABLES: dict[str, type[Base]] = {
+    'colors': Color,
+    'excluded': ExcludedItem,
+    'extras': Extra,
+    'images': Image,
+    'importance_num': ImportanceNum,
+    'parameters': Parameter,
+    'reviews': Review,
+    'reviews_video': ReviewVideo,
+}
+
+# Columns set when a row is created and kept as stored by later upserts,
+# as the ORM writer does
+INSERT_ONLY_COLUMNS: dict[type[Base], frozenset[str]] = {
+    Product: frozenset({'created_at'}),
+}
+
+
+def table_columns(table_cls: type[Base]) -> set[str]:
+    return set(table_cls.__table__.columns.keys())
+
+
+def model_to_row(
+    table_cls: type[Base],
+    model_obj: Any,
+    **overrides: Any
+) -> Row:
+    row: Row = model_obj.model_dump(include=table_columns(table_cls))
+    row.update(overrides)
+    return row
+
+
+def _build_on_conflict_upsert(
+    insert_fn: Callable[[type[Base]], Insert]
+) -> Callable[[type[Base], tuple[str, ...], set[str]], Insert]:
+    def build(
+        table_cls: type[Base],
+        index_elements: tuple[str, ...],
+        columns: set[str]
+    ) -> Insert:
+        stmt: Insert = insert_fn(table_cls)
+        set_: dict[str, Any] = {
+            name: stmt.excluded[name] for name in columns \
+                if name not in index_elements
+        }
+        if not set_:
+            return stmt.on_conflict_do_nothing(index_elements=index_elements)
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_=set_
+        )
+
+    return build
+
+
+def _build_on_duplicate_key_upsert(
+    table_cls: type[Base],
+    index_elements: tuple[str, ...],
+    columns: set[str]
+) -> Insert:
+    stmt: Insert = mysql_insert(table_cls)
+    # MySQL has no "do nothing" form, reassigning the key keeps the row as is
+    set_: dict[str, Any] = {
+        name: stmt.inserted[name] for name in columns \
+            if name not in index_elements
+    } or {name: stmt.inserted[name] for name in index_elements}
+    return stmt.on_duplicate_key_update(set_)
+
+
+UPSERT_BUILDERS: dict[
+    DatabaseType,
+    Callable[[type[Base], tuple[str, ...], set[str]], Insert]
+] = {
+    DatabaseType.POSTGRESQL: _build_on_conflict_upsert(postgresql_insert),
+    DatabaseType.MYSQL: _build_on_duplicate_key_upsert,
+    DatabaseType.MARIADB: _build_on_duplicate_key_upsert,
+}
+
+# ON CONFLICT appeared in SQLite 3.24
+if sqlite_version_info >= (3, 24):
+    UPSERT_BUILDERS[DatabaseType.SQLITE] = _build_on_conflict_upsert(
+        sqlite_insert
+    )
+
+
+def session_database_type(session: Session) -> DatabaseType | None:
+    try:
+        return DatabaseType(session.get_bind().dialect.name)
+    except ValueError:
+        return None
+
+
+def _upsert_generic(
+    session: Session,
+    table_cls: type[Base],
+    rows: list[Row],
+    index_elements: tuple[str, ...],
+    only_missing: bool = False
+):
+    """Fallback for dialects without native upsert: one SELECT of the
+    existing keys, then one bulk INSERT and one bulk UPDATE"""
+    key_column = getattr(table_cls, index_elements[0])
+    keys: list[Any] = [row[index_elements[0]] for row in rows]
+
+    existing_keys: set[Any] = set(session.scalars(
+        select(key_column).where(key_column.in_(keys))
+    ))
+
+    new_rows: list[Row] = [
+        row for row in rows if row[index_elements[0]] not in existing_keys
+    ]
+    insert_only: frozenset[str] = INSERT_ONLY_COLUMNS.get(table_cls, frozenset())
+    changed_rows: list[Row] = [
+        {name: value for name, value in row.items() if name not in insert_only}
+        for row in rows if row[index_elements[0]] in existing_keys
+    ]
+
+    if new_rows:
+        session.execute(insert(table_cls), new_rows)
+
+    # ORM bulk UPDATE matches rows by primary key only
+    if changed_rows and not only_missing and index_elements == ('id', ):
+        session.execute(update(table_cls), changed_rows)
+
+
+def upsert_rows(
+    session: Session,
+    table_cls: type[Base],
+    rows: list[Row],
+    index_elements: tuple[str, ...] = ('id', ),
+    only_missing: bool = False
+):
+    """Insert or update all ``rows`` of ``table_cls`` in batched statements,
+    with ``only_missing`` stored rows are left as they are"""
+    if not rows:
+        return
+
+    # One statement can't touch the same row twice, the last version wins
+    rows = list({
+        tuple(row[name] for name in index_elements): row for row in rows
+    }.values())
+
+    build: Callable | None = UPSERT_BUILDERS.get(session_database_type(session))
+
+    if build is None:
+        _upsert_generic(session, table_cls, rows, index_elements, only_missing)
+        return
+
+    # with only the key columns the builders emit "do nothing" on conflict
+    columns: set[str] = set(index_elements) if only_missing else \
+        set().union(*(row.keys() for row in rows)) - \
+            INSERT_ONLY_COLUMNS.get(table_cls, frozenset())
+    session.execute(build(table_cls, index_elements, columns), rows)
+
+
+def upsert_tags(
+    session: Session,
+    names: set[str],
+    cache: DictionaryCache | None = None
+) -> dict[str, int]:
+    """Create missing tags and return ``name -> id`` for all of ``names``,
+    only names unknown to ``cache`` reach the database"""
+    known: dict[str, int] = {}
+    if cache is not None:
+        known = {name: cache.tag_ids[name] for name in names \
+            if name in cache.tag_ids}
+        names = names - known.keys()
+
+    if not names:
+        return known
+
+    upsert_rows(
+        session=session,
+        table_cls=Tag,
+        rows=[{'name': name} for name in sorted(names)],
+        index_elements=('name', )
+    )
+
+    stmt: Select = select(Tag.id, Tag.name).where(Tag.name.in_(names))
+
+    for ident, name in session.execute(stmt):
+        known[name] = ident
+        if cache is not None:
+            cache.store(Tag, {'id': ident, 'name': name})
+
+    return known
+
+
+def write_dictionaries(
+    session: Session,
+    categories: Iterable[sc_Category],
+    product_marks: Iterable[sc_ProductMark],
+    cache: DictionaryCache | None = None
+):
+    category_rows: list[Row] = list({
+        category.id: model_to_row(Category, category)
+        for category in categories
+    }.values())
+    mark_rows: list[Row] = list({
+        mark.id: model_to_row(ProductMark, mark) for mark in product_marks
+    }.values())
+
+    if cache is not None:
+        category_rows = cache.changed_rows(Category, category_rows)
+        mark_rows = cache.changed_rows(ProductMark, mark_rows)
+
+    upsert_rows(session, Category, category_rows)
+    upsert_rows(session, ProductMark, mark_rows)
+
+    if cache is not None:
+        for row in category_rows:
+            cache.store(Category, row)
+        for row in mark_rows:
+            cache.store(ProductMark, row)
+
+
+def insert_missing_dictionaries(
+    session: Session,
+    categories: Iterable[sc_Category],
+    product_marks: Iterable[sc_ProductMark],
+    cache: DictionaryCache | None = None
+):
+    """Insert categories and product marks embedded in products only when
+    their id is not stored yet, the top-level feed copies written by
+    ``write_dictionaries`` take priority, as in ``merge_feeds``"""
+    for table_cls, models in (
+        (Category, categories),
+        (ProductMark, product_marks)
+    ):
+        rows: dict[int, Row] = {}
+        for model_obj in models:
+            if cache is None or cache.get(table_cls, model_obj.id) is None:
+                rows.setdefault(model_obj.id, model_to_row(table_cls, model_obj))
+
+        upsert_rows(session, table_cls, list(rows.values()), only_missing=True)
+
+        if cache is not None:
+            for row in rows.values():
+                cache.store(table_cls, row)
+
+
+@dataclass
+class ChildChanges:
+    """Set difference of one child table for a batch of products"""
+    insert: list[Row] = field(default_factory=list)
+    update: list[Row] = field(default_factory=list)
+    delete: set[int] = field(default_factory=set)
+
+
+def diff_children(
+    current: dict[int, Row],
+    incoming: list[Row]
+) -> ChildChanges:
+    """Compare rows stored for a batch with the incoming ones.
+
+    Rows without id (the feed sometimes omits it) are matched to stored
+    rows of the same product by content, so they are not rewritten on
+    every run.
+    """
+    changes: ChildChanges = ChildChanges()
+    incoming_ids: set[int] = {
+        row['id'] for row in incoming if row.get('id') is not None
+    }
+    # stored rows the feed doesn't reference by id, by content without id
+    unmatched: dict[tuple, list[int]] = {}
+    for ident, row in current.items():
+        if ident not in incoming_ids:
+            content: tuple = tuple(sorted(
+                (name, value) for name, value in row.items() if name != 'id'
+            ))
+            unmatched.setdefault(content, []).append(ident)
+
+    for row in incoming:
+        ident: int | None = row.get('id')
+
+        if ident is None:
+            row = {name: value for name, value in row.items() if name != 'id'}
+            content: tuple = tuple(sorted(row.items()))
+            if unmatched.get(content):
+                unmatched[content].pop()
+            else:
+                changes.insert.append(row)
+            continue
+
+        stored: Row | None = current.get(ident)
+        if stored is None:
+            changes.insert.append(row)
+        elif any(stored.get(name) != value for name, value in row.items()):
+            changes.update.append(row)
+
+    changes.delete = {
+        ident for idents in unmatched.values() for ident in idents
+    }
+
+    return changes
+
+
+def load_children(
+    session: Session,
+    table_cls: type[Base],
+    product_ids: list[int]
+) -> dict[int, Row]:
+    # ordered, so of equal rows without id the newest one is kept
+    stmt: Select = select(*table_cls.__table__.columns).where(
+        table_cls.product_id.in_(product_ids)
+    ).order_by(table_cls.id)
+    return {row.id: row._asdict() for row in session.execute(stmt)}
+
+
+def apply_child_changes(
+    session: Session,
+    table_cls: type[Base],
+    changes: ChildChanges
+):
+    if changes.delete:
+        session.execute(
+            delete(table_cls).where(
+                table_cls.id.in_(changes.delete)
+            ).execution_options(synchronize_session=False)
+        )
+
+    if changes.update:
+        session.execute(update(table_cls), changes.update)
+
+    keyed: list[Row] = [row for row in changes.insert if 'id' in row]
+    # a row may come from a product outside of the batch, hence upsert
+    upsert_rows(session, table_cls, keyed)
+
+    unkeyed: list[Row] = [row for row in changes.insert if 'id' not in row]
+    if unkeyed:
+        session.execute(insert(table_cls), unkeyed)
+
+
+def reconcile_associations(
+    session: Session,
+    association_cls: type[Base],
+    column_name: str,
+    product_ids: list[int],
+    pairs: set[tuple[int, int]]
+):
+    product_column = association_cls.product_id
+    other_column = getattr(association_cls, column_name)
+
+    current: set[tuple[int, int]] = set(session.execute(
+        select(product_column, other_column).where(
+            product_column.in_(product_ids)
+        )
+    ).tuples())
+
+    removed: set[tuple[int, int]] = current - pairs
+    added: set[tuple[int, int]] = pairs - current
+
+    if removed:
+        session.execute(
+            delete(association_cls).where(
+                tuple_(product_column, other_column).in_(removed)
+            ).execution_options(synchronize_session=False)
+        )
+
+    if added:
+        session.execute(
+            insert(association_cls),
+            [
+                {'product_id': product_id, column_name: other_id}
+                for product_id, other_id in sorted(added)
+            ]
+        )
+
+
+def reconcile_children(
+    session: Session,
+    products: list[sc_Product],
+    tag_ids: dict[str, int]
+):
+    """Sync every child table and association of a batch of products with
+    one SELECT and at most one statement per change kind and table"""
+    product_ids: list[int] = [product.id for product in products]
+
+    for attribute_name, table_cls in PRODUCT_CHILD_TABLES.items():
+        incoming: list[Row] = [
+            model_to_row(table_cls, model_obj, product_id=product.id)
+            for product in products \
+                for model_obj in getattr(product, attribute_name) or ()
+        ]
+
+        apply_child_changes(
+            session=session,
+            table_cls=table_cls,
+            changes=diff_children(
+                current=load_children(session, table_cls, product_ids),
+                incoming=incoming
+            )
+        )
+
+    reconcile_associations(
+        session=session,
+        association_cls=ProductCategoryAssociation,
+        column_name='category_id',
+        product_ids=product_ids,
+        pairs={
+            (product.id, category.id)
+            for product in products for category in product.categories
+        }
+    )
+    reconcile_associations(
+        session=session,
+        association_cls=ProductMarkAssociation,
+        column_name='mark_id',
+        product_ids=product_ids,
+        pairs={
+            (product.id, mark.id)
+            for product in products for mark in product.marks
+        }
+    )
+    reconcile_associations(
+        session=session,
+        association_cls=ProductTagAssociation,
+        column_name='tag_id',
+        product_ids=product_ids,
+        pairs={
+            (product.id, tag_ids[tag])
+            for product in products for tag in product.tags or ()
+        }
+    )
+
+
+def write_product_dictionaries(
+    session: Session,
+    products: list[sc_Product],
+    categories: Iterable[sc_Category] = (),
+    product_marks: Iterable[sc_ProductMark] = (),
+    cache: DictionaryCache | None = None
+) -> dict[str, int]:
+    """Write dictionaries referenced by ``products``, return tag ids.
+
+    ``categories`` and ``product_marks`` are the top-level ones of the feed
+    and overwrite stored rows, copies embedded in products only add ids
+    missing from them.
+    """
+    categories: list[sc_Category] = list(categories)
+    product_marks: list[sc_ProductMark] = list(product_marks)
+
+    write_dictionaries(session, categories, product_marks, cache)
+
+    category_ids: set[int] = {category.id for category in categories}
+    mark_ids: set[int] = {mark.id for mark in product_marks}
+
+    insert_missing_dictionaries(
+        session=session,
+        categories=(
+            category for product in products \
+                for category in product.categories \
+                    if category.id not in category_ids
+        ),
+        product_marks=(
+            mark for product in products for mark in product.marks \
+                if mark.id not in mark_ids
+        ),
+        cache=cache
+    )
+
+    return upsert_tags(
+        session=session,
+        names={tag for product in products for tag in product.tags or ()},
+        cache=cache
+    )
+
+
+def write_products_bulk(
+    session: Session,
+    products: Iterable[sc_Product],
+    categories: Iterable[sc_Category] = (),
+    product_marks: Iterable[sc_ProductMark] = (),
+    cache: DictionaryCache | None = None
+):
+    """Write products and every related row with a fixed number of
+    statements per table, whatever the size of ``products``"""
+    # the last version of a product repeated in ``products`` wins
+    products: list[sc_Product] = list({
+        product.id: product for product in products
+    }.values())
+
+    if not products:
+        write_dictionaries(session, categories, product_marks, cache)
+        return
+
+    tag_ids: dict[str, int] = write_product_dictionaries(
+        session=session,
+        products=products,
+        categories=categories,
+        product_marks=product_marks,
+        cache=cache
+    )
+
+    upsert_rows(
+        session=session,
+        table_cls=Product,
+        rows=[
+            model_to_row(Product, product, content_hash=product.content_hash)
+            for product in products
+        ]
+    )
+
+    reconcile_children(session, products, tag_ids)
+
+
+def delete_missing_products(
+    session: Session,
+    product_ids: Collection[int]
+) -> int:
+    """Delete stored products absent from ``product_ids`` in one statement,
+    child rows and associations go with them by ON DELETE CASCADE.
+
+    ``product_ids`` must be every product of the feed, an empty feed never
+    empties the catalog.
+    """
+    if not product_ids:
+        return 0
+
+    missing: set[int] = set(session.scalars(select(Product.id))) - \
+        set(product_ids)
+
+    if missing:
+        session.execute(
+            delete(Product).where(
+                Product.id.in_(missing)
+            ).execution_options(synchronize_session=False)
+        )
+        record_product_changes(session, missing, deleted=True)
+
+    return len(missing)
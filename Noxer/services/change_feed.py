@@ -0,0 +1,36 @@
+from collections.abc import Collection
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from products.models import ProductChange
+
+
+def record_product_changes(
+    session: Session,
+    product_ids: Collection[int],
+    deleted: bool = False
+):
+    """Append ``product_ids`` to the change feed, in the transaction of the
+    writes they describe.
+
+    On PostgreSQL the change table stays locked for writers until the
+    commit, so sequence numbers become visible in order and a client never
+    skips a change of a transaction still in progress.
+    """
+    if not product_ids:
+        return
+
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text(
+            f'LOCK TABLE {ProductChange.__tablename__} '
+            'IN SHARE ROW EXCLUSIVE MODE'
+        ))
+
+    session.execute(
+        insert(ProductChange),
+        [
+            {'product_id': product_id, 'deleted': deleted}
+            for product_id in sorted(product_ids)
+        ]
+    )
@@ -0,0 +1,88 @@
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from hashlib import sha256
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+
+from services.fetcher import FetchedFeed, redis_client
+from services.services_celery import logger
+from settings import cfg
+
+CHECKPOINT_KEY: str = 'noxer:ingest_checkpoint'
+
+
+def feed_fingerprint(feeds: Iterable[FetchedFeed]) -> str:
+    """Equal for the same feed bodies split into the same batches"""
+    digest = sha256(f'batch_size={cfg.INGEST_BATCH_SIZE}'.encode())
+    for feed in sorted(feeds, key=lambda feed: feed.on_main):
+        digest.update(f'\n{feed.url}\n'.encode())
+        digest.update(sha256(feed.content or b'').digest())
+    return digest.hexdigest()
+
+
+@dataclass
+class IngestCheckpoint:
+    """Progress of an ingest run, kept in Redis until the run is finished.
+
+    A run restarted over the same feeds gets the checkpoint back and
+    skips the batches already committed. Without Redis the run just
+    starts from the first batch, the content hash filter still leaves
+    written products untouched.
+    """
+    run_id: str
+    fingerprint: str
+    batches: int = 0
+
+    @classmethod
+    def resume(cls, fingerprint: str) -> 'IngestCheckpoint':
+        """Checkpoint of an interrupted run over the same feeds, otherwise
+        a new run"""
+        stored: dict[str, str] = {}
+        if cfg.INGEST_CHECKPOINTS:
+            try:
+                stored = redis_client().hgetall(CHECKPOINT_KEY)
+            except RedisError as e:
+                logger.warning(f'Ingest checkpoint not loaded: {e}')
+
+        if stored.get('fingerprint') == fingerprint:
+            checkpoint: IngestCheckpoint = cls(
+                run_id=stored['run_id'],
+                fingerprint=fingerprint,
+                batches=int(stored['batches'])
+            )
+            logger.info(
+                f'Ingest run {checkpoint.run_id} resumed after '
+                f'{checkpoint.batches} batches'
+            )
+            return checkpoint
+
+        checkpoint = cls(run_id=uuid4().hex, fingerprint=fingerprint)
+        checkpoint.save()
+        return checkpoint
+
+    def save(self):
+        if not cfg.INGEST_CHECKPOINTS:
+            return
+
+        try:
+            pipeline = redis_client().pipeline()
+            pipeline.hset(CHECKPOINT_KEY, mapping=asdict(self))
+            pipeline.expire(CHECKPOINT_KEY, cfg.INGEST_CHECKPOINT_TTL)
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning(f'Ingest checkpoint of {self.run_id} not saved: {e}')
+
+    def batch_written(self, batches: int):
+        self.batches = batches
+        self.save()
+
+    def finish(self):
+        """Must be called only after the whole run was written"""
+        if not cfg.INGEST_CHECKPOINTS:
+            return
+
+        try:
+            redis_client().delete(CHECKPOINT_KEY)
+        except RedisError as e:
+            logger.warning(f'Ingest checkpoint of {self.run_id} not removed: {e}')
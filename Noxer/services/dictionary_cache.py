@@ -0,0 +1,78 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Base
+from products.models import Category, ProductMark, Tag
+from services.ingest_stats import counted_if_committed
+
+Row = dict[str, Any]
+
+# Tiny tables shared by thousands of products
+DICTIONARY_TABLES: tuple[type[Base], ...] = (Category, ProductMark, Tag)
+
+
+class DictionaryCache:
+    """Ingest-scoped copy of tags, categories and product marks.
+
+    Filled with one query per table and kept up to date by the writers,
+    so resolving ``id -> row`` or a tag ``name -> id`` costs no round trip.
+    """
+
+    def __init__(self):
+        self.rows: dict[type[Base], dict[int, Row]] = {
+            table_cls: {} for table_cls in DICTIONARY_TABLES
+        }
+        self.tag_ids: dict[str, int] = {}
+
+    @classmethod
+    def preload(cls, session: Session) -> 'DictionaryCache':
+        cache: DictionaryCache = cls()
+
+        for table_cls in DICTIONARY_TABLES:
+            for row in session.execute(select(*table_cls.__table__.columns)):
+                cache.store(table_cls, row._asdict())
+
+        return cache
+
+    def store(self, table_cls: type[Base], row: Row):
+        self.rows[table_cls][row['id']] = row
+        if table_cls is Tag:
+            self.tag_ids[row['name']] = row['id']
+
+    def get(self, table_cls: type[Base], ident: int) -> Row | None:
+        return self.rows[table_cls].get(ident)
+
+    def changed_rows(self, table_cls: type[Base], rows: list[Row]) -> list[Row]:
+        """Rows that are missing from the cache or differ from it"""
+        cached: dict[int, Row] = self.rows[table_cls]
+        return [row for row in rows if cached.get(row['id']) != row]
+
+    def snapshot(self) -> tuple[dict[type[Base], dict[int, Row]], dict[str, int]]:
+        return (
+            {table_cls: dict(rows) for table_cls, rows in self.rows.items()},
+            dict(self.tag_ids)
+        )
+
+    def restore(
+        self,
+        snapshot: tuple[dict[type[Base], dict[int, Row]], dict[str, int]]
+    ):
+        self.rows, self.tag_ids = snapshot
+
+
+@contextmanager
+def savepoint(session: Session, cache: DictionaryCache) -> Iterator[None]:
+    """SAVEPOINT that also rolls back what the cache learned and the
+    ingest counters added inside it"""
+    snapshot: tuple = cache.snapshot()
+    try:
+        with counted_if_committed(), session.begin_nested():
+            yield
+    except Exception as e:
+        cache.restore(snapshot)
+        raise e
+
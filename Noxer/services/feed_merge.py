@@ -0,0 +1,81 @@
+from collections.abc import Iterable
+from datetime import UTC, datetime
+
+from products.schemas import Category, OnMainRootModel, Product, ProductMark, RootModel
+
+OLDEST: datetime = datetime.min.replace(tzinfo=UTC)
+
+MergePriority = tuple[datetime, bool]
+
+
+def merge_priority(product: Product) -> MergePriority:
+    """Of two versions of one product the freshest ``updated_at`` wins,
+    on a tie the version with ``on_main=True`` wins"""
+    return (product.updated_at or OLDEST, product.on_main)
+
+
+class ProductDeduplicator:
+    """Keeps the merge priority of every seen product id, so the same
+    decision is taken whatever order the feeds come in"""
+
+    def __init__(self):
+        self.seen: dict[int, MergePriority] = {}
+
+    def accept(self, product: Product) -> bool:
+        priority: MergePriority = merge_priority(product)
+        stored: MergePriority | None = self.seen.get(product.id)
+
+        if stored is not None and stored >= priority:
+            return False
+
+        self.seen[product.id] = priority
+        return True
+
+
+def merge_feeds(models: Iterable[RootModel]) -> OnMainRootModel:
+    """Merge validated on_main=true/false feeds into one model with
+    unique products, categories and product marks"""
+    products: dict[int, Product] = {}
+    categories: dict[int, Category] = {}
+    product_marks: dict[int, ProductMark] = {}
+    deduplicator: ProductDeduplicator = ProductDeduplicator()
+
+    for model in models:
+        for category in getattr(model, 'categories', ()):
+            categories[category.id] = category
+        for mark in getattr(model, 'product_marks', ()):
+            product_marks[mark.id] = mark
+
+        for product in model.products:
+            if deduplicator.accept(product):
+                products[product.id] = product
+
+    for product in products.values():
+        for category in product.categories:
+            categories.setdefault(category.id, category)
+        for mark in product.marks:
+            product_marks.setdefault(mark.id, mark)
+
+    return OnMainRootModel.model_construct(
+        status='ok',
+        products=sorted(products.values(), key=lambda product: product.id),
+        categories=sorted(categories.values(), key=lambda category: category.id),
+        product_marks=sorted(product_marks.values(), key=lambda mark: mark.id)
+    )
+
+
+def shard_products(
+    products: list[Product],
+    shards: int,
+    min_size: int = 1
+) -> list[list[Product]]:
+    """Split products sorted by id into at most ``shards`` contiguous id
+    ranges of at least ``min_size`` products, so parallel writers never
+    touch the same product"""
+    if not products:
+        return [products]
+
+    shards = max(1, min(shards, len(products) // max(min_size, 1)))
+    size: int = -(-len(products) // shards)
+
+    return [products[i:i + size] for i in range(0, len(products), size)]
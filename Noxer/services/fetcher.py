@@ -0,0 +1,287 @@
+from asyncio import gather, run
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from functools import cache
+from importlib.util import find_spec
+from typing import Any
+
+from httpx import AsyncClient, Client, Limits, Response, Timeout
+from redis import Redis
+from redis.exceptions import RedisError
+
+from services.services_celery import logger
+from settings import cfg
+
+NOT_MODIFIED: int = 304
+
+# on_main values of the feeds merged by one ingest run
+FEEDS_ON_MAIN: tuple[bool, ...] = (True, False)
+
+VALIDATORS_KEY: str = 'noxer:feed_validators:{url}'
+
+# httpx decodes br only with the brotli package installed
+ACCEPT_ENCODING: str = 'br, gzip, deflate' if find_spec('brotli') else \
+    'gzip, deflate'
+
+
+@dataclass
+class FetchedFeed:
+    on_main: bool
+    url: str
+    not_modified: bool = False
+    content: bytes | None = None
+    chunks: Iterator[bytes] | AsyncIterator[bytes] | None = None
+    validators: dict[str, str] = field(default_factory=dict)
+    # sha256 of content, see services.payload_cache
+    content_hash: str | None = None
+
+
+def client_options() -> dict[str, Any]:
+    return {
+        'timeout': Timeout(
+            timeout=cfg.HTTP_TIMEOUT,
+            connect=cfg.HTTP_CONNECT_TIMEOUT
+        ),
+        'limits': Limits(
+            max_connections=cfg.HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=cfg.HTTP_KEEPALIVE_EXPIRY
+        ),
+        'headers': {
+            'Accept': 'application/json',
+            'Accept-Encoding': ACCEPT_ENCODING
+        }
+    }
+
+
+def feed_url(on_main: bool) -> str:
+    return f'{cfg.PRODUCTS_API_URL}?on_main={str(on_main).lower()}'
+
+
+@cache
+def redis_client() -> Redis:
+    return Redis.from_url(
+        url=cfg.REDIS_URL,
+        decode_responses=True,
+        socket_timeout=cfg.HTTP_CONNECT_TIMEOUT
+    )
+
+
+def load_validators(url: str) -> dict[str, str]:
+    try:
+        return redis_client().hgetall(VALIDATORS_KEY.format(url=url))
+    except RedisError as e:
+        logger.warning(f'Feed validators for {url} not loaded: {e}')
+        return {}
+
+
+def save_validators(feed: FetchedFeed):
+    """Must be called only after the feed was written, otherwise a failed
+    ingest would be skipped by the next 304"""
+    if not feed.validators:
+        return
+
+    try:
+        redis_client().hset(
+            name=VALIDATORS_KEY.format(url=feed.url),
+            mapping=feed.validators
+        )
+    except RedisError as e:
+        logger.warning(f'Feed validators for {feed.url} not saved: {e}')
+
+
+def conditional_headers(url: str) -> dict[str, str]:
+    validators: dict[str, str] = load_validators(url)
+    headers: dict[str, str] = {}
+
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last-modified' in validators:
+        headers['If-Modified-Since'] = validators['last-modified']
+
+    return headers
+
+
+def feeds_headers(
+    *on_main_values: bool,
+    conditional: bool = True
+) -> dict[bool, dict[str, str]]:
+    """Request headers of every feed by ``on_main``, loaded before the
+    event loop starts: a sync Redis call inside it stalls every download"""
+    return {
+        on_main: conditional_headers(feed_url(on_main)) if conditional else {}
+        for on_main in on_main_values
+    }
+
+
+def response_validators(response: Response) -> dict[str, str]:
+    return {
+        name: response.headers[name] for name in ('etag', 'last-modified') \
+            if name in response.headers
+    }
+
+
+async def fetch_feed(
+    client: AsyncClient,
+    on_main: bool,
+    headers: dict[str, str]
+) -> FetchedFeed:
+    url: str = feed_url(on_main)
+
+    response: Response = await client.get(url=url, headers=headers)
+
+    if response.status_code == NOT_MODIFIED:
+        logger.info(f'Feed {url} not modified')
+        return FetchedFeed(on_main=on_main, url=url, not_modified=True)
+
+    response.raise_for_status()
+
+    return FetchedFeed(
+        on_main=on_main,
+        url=url,
+        content=response.content,
+        validators=response_validators(response)
+    )
+
+
+async def fetch_feeds_async(
+    headers: dict[bool, dict[str, str]]
+) -> list[FetchedFeed]:
+    async with AsyncClient(**client_options()) as client:
+        return list(await gather(*(
+            fetch_feed(client, on_main, feed_headers) \
+                for on_main, feed_headers in headers.items()
+        )))
+
+
+def fetch_feeds(
+    *on_main_values: bool,
+    conditional: bool = True
+) -> list[FetchedFeed]:
+    """Download feeds for every ``on_main`` value concurrently over one
+    pooled client"""
+    return run(fetch_feeds_async(
+        feeds_headers(*on_main_values, conditional=conditional)
+    ))
+
+
+def fetch_merge_feeds() -> list[FetchedFeed] | None:
+    """Fetch every feed of the merge, ``None`` if none of them changed.
+
+    If only some feeds answered 304 the rest are fetched again without
+    validators: a merge of partial data could let a stale product version
+    win over the one from the unchanged feed.
+    """
+    feeds: list[FetchedFeed] = fetch_feeds(*FEEDS_ON_MAIN)
+
+    if all(feed.not_modified for feed in feeds):
+        return None
+
+    if any(feed.not_modified for feed in feeds):
+        feeds = fetch_feeds(*FEEDS_ON_MAIN, conditional=False)
+
+    return feeds
+
+
+@contextmanager
+def stream_feed(
+    on_main: bool,
+    conditional: bool = True
+) -> Iterator[FetchedFeed]:
+    url: str = feed_url(on_main)
+
+    with Client(**client_options()) as client, client.stream(
+        method='GET',
+        url=url,
+        headers=conditional_headers(url) if conditional else {}
+    ) as response:
+        if response.status_code == NOT_MODIFIED:
+            logger.info(f'Feed {url} not modified')
+            yield FetchedFeed(on_main=on_main, url=url, not_modified=True)
+            return
+
+        response.raise_for_status()
+
+        yield FetchedFeed(
+            on_main=on_main,
+            url=url,
+            chunks=response.iter_bytes(chunk_size=cfg.INGEST_STREAM_CHUNK_SIZE),
+            validators=response_validators(response)
+        )
+
+
+def iter_streamed_merge_feeds() -> Iterator[FetchedFeed]:
+    """Open the feeds of the merge one after another, each is yielded
+    while its body is still downloading.
+
+    Feeds answered 304 are streamed again without validators at the end,
+    unless every feed was not modified.
+    """
+    not_modified: list[bool] = []
+
+    for on_main in FEEDS_ON_MAIN:
+        with stream_feed(on_main=on_main) as feed:
+            if feed.not_modified:
+                not_modified.append(on_main)
+                continue
+            yield feed
+
+    if len(not_modified) == len(FEEDS_ON_MAIN):
+        return
+
+    for on_main in not_modified:
+        with stream_feed(on_main=on_main, conditional=False) as feed:
+            yield feed
+
+
+@asynccontextmanager
+async def astream_feed(
+    client: AsyncClient,
+    on_main: bool,
+    headers: dict[str, str]
+) -> AsyncIterator[FetchedFeed]:
+    url: str = feed_url(on_main)
+
+    async with client.stream(
+        method='GET',
+        url=url,
+        headers=headers
+    ) as response:
+        if response.status_code == NOT_MODIFIED:
+            logger.info(f'Feed {url} not modified')
+            yield FetchedFeed(on_main=on_main, url=url, not_modified=True)
+            return
+
+        response.raise_for_status()
+
+        yield FetchedFeed(
+            on_main=on_main,
+            url=url,
+            chunks=response.aiter_bytes(
+                chunk_size=cfg.INGEST_STREAM_CHUNK_SIZE
+            ),
+            validators=response_validators(response)
+        )
+
+
+async def aiter_streamed_merge_feeds(
+    client: AsyncClient,
+    headers: dict[bool, dict[str, str]]
+) -> AsyncIterator[FetchedFeed]:
+    """Async version of ``iter_streamed_merge_feeds``, ``headers`` come
+    from ``feeds_headers(*FEEDS_ON_MAIN)``"""
+    not_modified: list[bool] = []
+
+    for on_main in FEEDS_ON_MAIN:
+        async with astream_feed(client, on_main, headers[on_main]) as feed:
+            if feed.not_modified:
+                not_modified.append(on_main)
+                continue
+            yield feed
+
+    if len(not_modified) == len(FEEDS_ON_MAIN):
+        return
+
+    for on_main in not_modified:
+        async with astream_feed(client, on_main, {}) as feed:
+            yield feed
@@ -0,0 +1,97 @@
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from random import random
+from time import perf_counter
+from typing import Any
+
+from settings import cfg
+
+
+class IngestStats:
+    """Per-run counters and phase timings, logged once as a summary
+    instead of a line per product"""
+
+    def __init__(self):
+        self.started: float = perf_counter()
+        self.counters: Counter[str] = Counter()
+        self.seconds: dict[str, float] = defaultdict(float)
+
+    def summary(self) -> str:
+        counters: str = ', '.join(
+            f'{name}={value}' for name, value in sorted(self.counters.items())
+        )
+        phases: str = ', '.join(
+            f'{name} {seconds:.3f}s'
+            for name, seconds in sorted(self.seconds.items())
+        )
+        return f'{perf_counter() - self.started:.3f}s: {counters or "nothing"}' \
+            f'{f"; phases: {phases}" if phases else ""}'
+
+
+current_stats: ContextVar[IngestStats | None] = ContextVar(
+    'current_stats',
+    default=None
+)
+
+
+@contextmanager
+def ingest_run(name: str, log: Callable[[str], Any]) -> Iterator[IngestStats]:
+    """Collect the stats of one ingest run and ``log`` their summary at
+    the end, a nested run adds to the outer one"""
+    stats: IngestStats | None = current_stats.get()
+    if stats is not None:
+        yield stats
+        return
+
+    stats = IngestStats()
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+        log(f'{name} finished in {stats.summary()}')
+
+
+def count(name: str, value: int = 1):
+    stats: IngestStats | None = current_stats.get()
+    if stats is not None:
+        stats.counters[name] += value
+
+
+@contextmanager
+def counted_if_committed() -> Iterator[None]:
+    """Counters added inside are dropped again when the block raises, for
+    work that is rolled back and retried"""
+    stats: IngestStats | None = current_stats.get()
+    if stats is None:
+        yield
+        return
+
+    counters: Counter[str] = stats.counters.copy()
+    try:
+        yield
+    except Exception as e:
+        stats.counters = counters
+        raise e
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    stats: IngestStats | None = current_stats.get()
+    if stats is None:
+        yield
+        return
+
+    start: float = perf_counter()
+    try:
+        yield
+    finally:
+        stats.seconds[name] += perf_counter() - start
+
+
+def sampled() -> bool:
+    """Whether this entity gets its detail logged, ``cfg.LOG_SAMPLE_RATE``
+    of them do"""
+    return cfg.LOG_SAMPLE_RATE > 0 and random() < cfg.LOG_SAMPLE_RATE
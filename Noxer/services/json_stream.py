@@ -0,0 +1,150 @@
+from codecs import getincrementaldecoder
+from collections.abc import Container, Iterable, Iterator
+from json import JSONDecodeError, JSONDecoder
+from typing import Any
+
+WHITESPACE: frozenset[str] = frozenset(' \t\n\r')
+
+# A bare number cut by a chunk boundary ends with these, "2." or "1e-"
+NUMBER_CHARS: frozenset[str] = frozenset('0123456789.eE+-')
+
+# Consumed text is dropped from the buffer once it grows past this size
+COMPACT_THRESHOLD: int = 1 << 16
+
+
+class JsonStreamReader:
+    """Incremental reader of a top-level JSON object.
+
+    Keys listed in ``stream_keys`` must hold arrays, their elements are
+    decoded one by one as soon as they are complete. Any other top-level
+    value is decoded whole.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._text_decoder = getincrementaldecoder('utf-8')()
+        self._json_decoder: JSONDecoder = JSONDecoder()
+        self._buffer: str = ''
+        self._pos: int = 0
+        self._eof: bool = False
+        # bytes given to the text decoder, for errors in invalid UTF-8
+        self._bytes_read: int = 0
+
+    def _decode_text(self, chunk: bytes, final: bool = False) -> str:
+        # bytes of a character cut by the previous chunk
+        pending: bytes = self._text_decoder.getstate()[0]
+        try:
+            text: str = self._text_decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            offset: int = self._bytes_read - len(pending) + e.start
+            raise JSONDecodeError(
+                f'Invalid UTF-8 at byte {offset}: {e.reason}',
+                self._buffer,
+                len(self._buffer)
+            ) from e
+
+        self._bytes_read += len(chunk)
+        return text
+
+    def _read(self) -> bool:
+        if self._eof:
+            return False
+
+        if self._pos > COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+        for chunk in self._chunks:
+            text: str = self._decode_text(chunk)
+            if text:
+                self._buffer += text
+                return True
+
+        self._buffer += self._decode_text(b'', final=True)
+        self._eof = True
+        return False
+
+    def _error(self, message: str) -> JSONDecodeError:
+        return JSONDecodeError(message, self._buffer, self._pos)
+
+    def _next_char(self) -> str:
+        while True:
+            while self._pos < len(self._buffer):
+                char: str = self._buffer[self._pos]
+                if char not in WHITESPACE:
+                    return char
+                self._pos += 1
+            if not self._read():
+                raise self._error('Unexpected end of JSON stream')
+
+    def _expect(self, *chars: str) -> str:
+        char: str = self._next_char()
+        if char not in chars:
+            raise self._error(f'Expecting one of {chars!r}, got {char!r}')
+        self._pos += 1
+        return char
+
+    def _number_may_continue(self, end: int) -> bool:
+        """Nothing but number characters follow ``end`` up to the end of
+        the buffer, so the decoded value may be a cut number"""
+        return not self._eof and all(
+            char in NUMBER_CHARS for char in self._buffer[end:]
+        )
+
+    def _decode_value(self) -> Any:
+        self._next_char()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buffer,
+                    self._pos
+                )
+            except JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+
+            # a number at the end of buffer could go on in the next chunk
+            if self._number_may_continue(end) and self._read():
+                continue
+
+            self._pos = end
+            return value
+
+    def iter_items(
+        self,
+        stream_keys: Container[str]
+    ) -> Iterator[tuple[str, Any]]:
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+
+        while True:
+            key: Any = self._decode_value()
+            if not isinstance(key, str):
+                raise self._error('Expecting property name')
+            self._expect(':')
+
+            if key in stream_keys:
+                self._expect('[')
+                if self._next_char() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield key, self._decode_value()
+                        if self._expect(',', ']') == ']':
+                            break
+            else:
+                yield key, self._decode_value()
+
+            if self._expect(',', '}') == '}':
+                return
+
+
+def iter_json_object_items(
+    chunks: Iterable[bytes],
+    stream_keys: Container[str] = ()
+) -> Iterator[tuple[str, Any]]:
+    """Yield ``(key, value)`` of a JSON object read from byte ``chunks``,
+    elements of ``stream_keys`` arrays are yielded one per item"""
+    yield from JsonStreamReader(chunks).iter_items(stream_keys)
@@ -0,0 +1,129 @@
+from gzip import compress, decompress
+from hashlib import sha256
+from os import replace
+from pathlib import Path
+from re import sub
+
+from services.fetcher import FEEDS_ON_MAIN, FetchedFeed, feed_url
+from services.services_celery import logger
+from settings import cfg
+
+PAYLOAD_SUFFIX: str = '.json.gz'
+POINTER_SUFFIX: str = '.last'
+
+# Feeds are compressed once per change, a middle level is enough
+COMPRESS_LEVEL: int = 6
+
+
+def payload_hash(content: bytes) -> str:
+    return sha256(content).hexdigest()
+
+
+def cache_dir() -> Path:
+    return Path(cfg.PAYLOAD_CACHE_DIR)
+
+
+def payload_path(content_hash: str) -> Path:
+    return cache_dir() / f'{content_hash}{PAYLOAD_SUFFIX}'
+
+
+def pointer_path(url: str) -> Path:
+    """File holding the hash of the last payload of ``url`` written to the
+    database"""
+    return cache_dir() / f'{sub(r"[^A-Za-z0-9]+", "_", url).strip("_")}' \
+        f'{POINTER_SUFFIX}'
+
+
+def write_atomic(path: Path, data: bytes):
+    # a crash leaves the old file or the new one, never a torn one
+    temporary: Path = path.with_name(f'.{path.name}.tmp')
+    temporary.write_bytes(data)
+    replace(temporary, path)
+
+
+def last_payload_hash(url: str) -> str | None:
+    try:
+        return pointer_path(url).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f'Payload pointer of {url} not read: {e}')
+        return None
+
+
+def payload_unchanged(feed: FetchedFeed) -> bool:
+    """The body of ``feed`` is the one the last successful run wrote"""
+    if not cfg.PAYLOAD_CACHE or feed.content is None:
+        return False
+
+    feed.content_hash = feed.content_hash or payload_hash(feed.content)
+    return feed.content_hash == last_payload_hash(feed.url)
+
+
+def store_payload(feed: FetchedFeed):
+    """Keep the compressed body of ``feed`` under its content hash, the
+    endpoint points at it only once the run is written"""
+    if not cfg.PAYLOAD_CACHE or feed.content is None:
+        return
+
+    feed.content_hash = feed.content_hash or payload_hash(feed.content)
+    path: Path = payload_path(feed.content_hash)
+
+    try:
+        cache_dir().mkdir(parents=True, exist_ok=True)
+        if not path.exists():
+            write_atomic(path, compress(feed.content, COMPRESS_LEVEL))
+    except OSError as e:
+        logger.warning(f'Payload of {feed.url} not cached: {e}')
+
+
+def mark_payload_written(feed: FetchedFeed):
+    """Must be called only after the feed was written, like
+    ``save_validators``. The payload the endpoint pointed at before is
+    removed unless another endpoint still points at it."""
+    if not cfg.PAYLOAD_CACHE or feed.content_hash is None:
+        return
+
+    previous: str | None = last_payload_hash(feed.url)
+
+    try:
+        write_atomic(pointer_path(feed.url), feed.content_hash.encode())
+
+        if previous is None or previous == feed.content_hash:
+            return
+
+        pointed: set[str | None] = {
+            last_payload_hash(feed_url(on_main)) for on_main in FEEDS_ON_MAIN
+        }
+        if previous not in pointed:
+            payload_path(previous).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f'Payload pointer of {feed.url} not saved: {e}')
+
+
+def load_cached_feeds() -> list[FetchedFeed] | None:
+    """Last written payloads of every feed of the merge, ``None`` if any
+    of them is missing"""
+    feeds: list[FetchedFeed] = []
+
+    for on_main in FEEDS_ON_MAIN:
+        url: str = feed_url(on_main)
+        content_hash: str | None = last_payload_hash(url)
+        if content_hash is None:
+            logger.warning(f'No cached payload of {url}')
+            return None
+
+        try:
+            content: bytes = decompress(payload_path(content_hash).read_bytes())
+        except (OSError, EOFError) as e:
+            logger.warning(f'Cached payload of {url} not read: {e}')
+            return None
+
+        feeds.append(FetchedFeed(
+            on_main=on_main,
+            url=url,
+            content=content,
+            content_hash=content_hash
+        ))
+
+    return feeds
@@ -0,0 +1,332 @@
+from collections.abc import Iterable
+from csv import QUOTE_NOTNULL, writer
+from functools import cache
+from io import StringIO
+
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    Delete,
+    Insert,
+    Integer,
+    MetaData,
+    Subquery,
+    Table,
+    and_,
+    delete,
+    exists,
+    func,
+    select,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+from database import Base
+from products.models import (
+    Product,
+    ProductCategoryAssociation,
+    ProductMarkAssociation,
+    ProductTagAssociation,
+)
+from products.schemas import Product as sc_Product
+from services.bulk_upsert import (
+    INSERT_ONLY_COLUMNS,
+    PRODUCT_CHILD_TABLES,
+    Row,
+    model_to_row,
+)
+
+# Order of the staged rows, unkeyed child rows get their ids in this order
+POSITION: str = 'row_position'
+
+staging_metadata: MetaData = MetaData()
+
+
+@cache
+def staging_table(table_cls: type[Base]) -> Table:
+    """Temporary table with the columns of ``table_cls`` and no constraints.
+
+    Temporary tables are unlogged and private to the connection, so
+    parallel shards never see each other's rows.
+    """
+    return Table(
+        f'staging_{table_cls.__tablename__}',
+        staging_metadata,
+        *(
+            Column(column.name, column.type, nullable=True)
+            for column in table_cls.__table__.columns
+        ),
+        Column(POSITION, Integer),
+        prefixes=['TEMPORARY']
+    )
+
+
+STAGED_TABLES: tuple[type[Base], ...] = (
+    Product,
+    *PRODUCT_CHILD_TABLES.values(),
+    ProductCategoryAssociation,
+    ProductMarkAssociation,
+    ProductTagAssociation,
+)
+
+
+@cache
+def prepare_staging_sql() -> str:
+    """Create the staging tables once per connection and empty them,
+    in one round trip"""
+    dialect: postgresql.dialect = postgresql.dialect()
+    statements: list[str] = [
+        str(CreateTable(
+            staging_table(table_cls),
+            if_not_exists=True
+        ).compile(dialect=dialect)).strip()
+        for table_cls in STAGED_TABLES
+    ]
+    statements.append('TRUNCATE ' + ', '.join(
+        staging_table(table_cls).name for table_cls in STAGED_TABLES
+    ))
+    return ';\n'.join(statements)
+
+
+def copy_supported(session: Session) -> bool:
+    dialect = session.get_bind().dialect
+    return dialect.name == 'postgresql' and dialect.driver == 'psycopg2'
+
+
+def copy_rows(session: Session, table_cls: type[Base], rows: list[Row]):
+    """Stream ``rows`` into the staging table of ``table_cls`` by
+    ``COPY FROM STDIN``"""
+    if not rows:
+        return
+
+    stage: Table = staging_table(table_cls)
+    names: list[str] = [
+        column.name for column in stage.columns if column.name != POSITION
+    ]
+
+    buffer: StringIO = StringIO()
+    # None stays an unquoted empty field, which CSV COPY reads as NULL
+    csv_writer = writer(buffer, quoting=QUOTE_NOTNULL)
+    for position, row in enumerate(rows):
+        csv_writer.writerow([*(row.get(name) for name in names), position])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {stage.name} ({", ".join(names)}, {POSITION}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def merge_upsert(table_cls: type[Base]) -> Insert:
+    """Upsert keyed staging rows, rows equal to the stored ones are left
+    untouched"""
+    table: Table = table_cls.__table__
+    stage: Table = staging_table(table_cls)
+    names: list[str] = list(table.columns.keys())
+
+    stmt: Insert = postgresql_insert(table).from_select(
+        names,
+        select(*(stage.c[name] for name in names)).where(
+            stage.c.id.is_not(None)
+        )
+    )
+    insert_only: frozenset[str] = INSERT_ONLY_COLUMNS.get(table_cls, frozenset())
+    values: list[str] = [
+        name for name in names if name != 'id' and name not in insert_only
+    ]
+
+    return stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={name: stmt.excluded[name] for name in values},
+        where=tuple_(*(table.c[name] for name in values)).is_distinct_from(
+            tuple_(*(stmt.excluded[name] for name in values))
+        )
+    )
+
+
+def unkeyed_matches(
+    table_cls: type[Base]
+) -> tuple[Subquery, Subquery, ColumnElement[bool]]:
+    """Stored rows of the batch not referenced by id and staged rows
+    without id, numbered inside groups of equal content.
+
+    A staged row and a stored one match when content and number are
+    equal, like the multiset matching of ``bulk_upsert.diff_children``.
+    """
+    table: Table = table_cls.__table__
+    stage: Table = staging_table(table_cls)
+    product_stage: Table = staging_table(Product)
+    content: list[str] = [name for name in table.columns.keys() if name != 'id']
+
+    stored: Subquery = select(
+        table.c.id,
+        *(table.c[name] for name in content),
+        func.row_number().over(
+            partition_by=[table.c[name] for name in content],
+            order_by=table.c.id.desc()
+        ).label('number')
+    ).where(
+        table.c.product_id.in_(select(product_stage.c.id)),
+        table.c.id.not_in(
+            select(stage.c.id).where(stage.c.id.is_not(None))
+        )
+    ).subquery('stored')
+
+    incoming: Subquery = select(
+        *(stage.c[name] for name in content),
+        stage.c[POSITION],
+        func.row_number().over(
+            partition_by=[stage.c[name] for name in content],
+            order_by=stage.c[POSITION]
+        ).label('number')
+    ).where(stage.c.id.is_(None)).subquery('incoming')
+
+    matched: ColumnElement[bool] = and_(
+        *(
+            stored.c[name].is_not_distinct_from(incoming.c[name])
+            for name in content
+        ),
+        stored.c.number == incoming.c.number
+    )
+
+    return stored, incoming, matched
+
+
+def merge_children(
+    session: Session,
+    table_cls: type[Base],
+    has_unkeyed: bool
+):
+    """Same changes as ``bulk_upsert.apply_child_changes`` with set-based
+    statements over the staging table"""
+    table: Table = table_cls.__table__
+    stored, incoming, matched = unkeyed_matches(table_cls)
+
+    stale: Delete = delete(table).where(
+        table.c.id.in_(
+            select(stored.c.id).where(~exists().where(matched))
+        )
+    )
+    session.execute(stale)
+
+    session.execute(merge_upsert(table_cls))
+
+    if not has_unkeyed:
+        return
+
+    # recounted after the delete, only the kept stored rows are left
+    stored, incoming, matched = unkeyed_matches(table_cls)
+    content: list[str] = [name for name in table.columns.keys() if name != 'id']
+    session.execute(
+        postgresql_insert(table).from_select(
+            content,
+            select(*(incoming.c[name] for name in content)).where(
+                ~exists().where(matched)
+            ).order_by(incoming.c[POSITION])
+        )
+    )
+
+
+def merge_associations(
+    session: Session,
+    association_cls: type[Base],
+    column_name: str
+):
+    table: Table = association_cls.__table__
+    stage: Table = staging_table(association_cls)
+    product_stage: Table = staging_table(Product)
+
+    session.execute(
+        delete(table).where(
+            table.c.product_id.in_(select(product_stage.c.id)),
+            tuple_(table.c.product_id, table.c[column_name]).not_in(
+                select(stage.c.product_id, stage.c[column_name])
+            )
+        )
+    )
+    session.execute(
+        postgresql_insert(table).from_select(
+            ['product_id', column_name],
+            select(stage.c.product_id, stage.c[column_name]).distinct()
+        ).on_conflict_do_nothing()
+    )
+
+
+def unique_keyed(rows: Iterable[Row]) -> list[Row]:
+    """Keyed rows repeated in the batch collapse to the last version,
+    rows without id are kept as they are"""
+    keyed: dict[int, Row] = {}
+    unkeyed: list[Row] = []
+    for row in rows:
+        if row.get('id') is None:
+            unkeyed.append(row)
+        else:
+            keyed.pop(row['id'], None)
+            keyed[row['id']] = row
+    return [*keyed.values(), *unkeyed]
+
+
+def write_products_copy(
+    session: Session,
+    products: list[sc_Product],
+    tag_ids: dict[str, int]
+):
+    """Write a batch of products through PostgreSQL ``COPY`` into staging
+    tables merged by a few set-based statements.
+
+    The resulting rows are the same as with ``write_products_bulk``.
+    """
+    products = list({product.id: product for product in products}.values())
+    if not products:
+        return
+
+    session.connection().exec_driver_sql(prepare_staging_sql())
+
+    copy_rows(session, Product, [
+        model_to_row(Product, product, content_hash=product.content_hash)
+        for product in products
+    ])
+    session.execute(merge_upsert(Product))
+
+    for attribute_name, table_cls in PRODUCT_CHILD_TABLES.items():
+        rows: list[Row] = unique_keyed(
+            model_to_row(table_cls, model_obj, product_id=product.id)
+            for product in products \
+                for model_obj in getattr(product, attribute_name) or ()
+        )
+        copy_rows(session, table_cls, rows)
+        merge_children(
+            session=session,
+            table_cls=table_cls,
+            has_unkeyed=any(row.get('id') is None for row in rows)
+        )
+
+    associations: dict[type[Base], tuple[str, set[tuple[int, int]]]] = {
+        ProductCategoryAssociation: ('category_id', {
+            (product.id, category.id)
+            for product in products for category in product.categories
+        }),
+        ProductMarkAssociation: ('mark_id', {
+            (product.id, mark.id)
+            for product in products for mark in product.marks
+        }),
+        ProductTagAssociation: ('tag_id', {
+            (product.id, tag_ids[tag])
+            for product in products for tag in product.tags or ()
+        }),
+    }
+
+    for association_cls, (column_name, pairs) in associations.items():
+        copy_rows(session, association_cls, [
+            {'product_id': product_id, column_name: other_id}
+            for product_id, other_id in sorted(pairs)
+        ])
+        merge_associations(session, association_cls, column_name)
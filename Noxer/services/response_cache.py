@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from hashlib import sha256
+from threading import Lock
+from time import monotonic, time_ns
+from urllib.parse import urlencode
+
+from redis.asyncio import Redis
+
+from settings import cfg
+
+# Bumped by the ingest after every commit, see celery_app
+CATALOG_GENERATION_KEY: str = 'noxer:catalog_generation'
+RESPONSE_KEY: str = 'noxer:response:{endpoint}:{args}'
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    body: str
+
+
+class LocalResponseCache:
+    """Bounded LRU of responses of one worker, an entry is served for
+    ``ttl`` seconds at most: the worker does not see the catalog
+    generation change"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.entries: OrderedDict[str, tuple[float, CachedResponse]] = \
+            OrderedDict()
+        self.lock: Lock = Lock()
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self.lock:
+            entry: tuple[float, CachedResponse] | None = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, response = entry
+            if expires < monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return response
+
+    def put(self, key: str, response: CachedResponse):
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+def response_key(
+    endpoint: str,
+    args: Iterable[tuple[str, int | str | None]]
+) -> str:
+    """Key of a response of ``endpoint`` to the normalized ``args``"""
+    query: str = urlencode(
+        [(name, value) for name, value in args if value is not None]
+    )
+    return RESPONSE_KEY.format(
+        endpoint=endpoint,
+        args=sha256(query.encode()).hexdigest()
+    )
+
+
+async def load_response(redis: Redis, key: str) -> tuple[str, str | None]:
+    """Current catalog generation and the response cached under ``key``
+    for it, ``None`` if there is none.
+
+    The generation is stored along with the response instead of being a
+    part of the key, so both come in one round trip.
+    """
+    generation, cached = await redis.mget(CATALOG_GENERATION_KEY, key)
+
+    if generation is None:
+        # never restart from a number older ETags were made of, the
+        # ingest increments whatever is set here
+        await redis.set(CATALOG_GENERATION_KEY, time_ns(), nx=True)
+        generation = await redis.get(CATALOG_GENERATION_KEY)
+
+    if cached is None:
+        return generation, None
+
+    cached_generation, _, body = cached.partition(':')
+    return generation, body if cached_generation == generation else None
+
+
+async def save_response(redis: Redis, key: str, generation: str, body: str):
+    await redis.set(key, f'{generation}:{body}', ex=cfg.RESPONSE_CACHE_TTL)
+
+
+def response_etag(key: str, generation: str | None, body: str) -> str:
+    """Strong ETag of a response: the same arguments give the same body
+    within a catalog generation. Without the generation the body is
+    hashed."""
+    source: str = f'{generation}:{key}' if generation is not None else body
+    return sha256(source.encode()).hexdigest()[:32]
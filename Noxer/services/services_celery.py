@@ -1,35 +1,44 @@
 from atexit import register
+from collections.abc import Callable, Collection, Iterable, Iterator
+from datetime import UTC, datetime
+from itertools import batched, chain
 from sys import stderr
-from typing import Any, TypeVar
+from typing import Any
 
 from celery import Celery
-from httpx import Client, Response
-from httpx._exceptions import HTTPStatusError
 from loguru._defaults import LOGURU_AUTOINIT
 from loguru._logger import Core, Logger
-from sqlalchemy import IteratorResult, Select, select
+from pydantic import ValidationError
+from sqlalchemy import Select, select
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy.orm.collections import InstrumentedList
+from sqlalchemy.orm import Session
 
 from database import sync_session_maker
-from products.models import (
-    Category,
-    Color,
-    ExcludedItem,
-    Extra,
-    Image,
-    ImportanceNum,
-    Parameter,
-    Product,
-    ProductMark,
-    Review,
-    ReviewVideo,
-    Tag,
-)
+from products.models import Product
+from products.schemas import Category as sc_Category
 from products.schemas import OnMainRootModel, RootModel
 from products.schemas import Product as sc_Product
-from settings import cfg
+from products.schemas import ProductMark as sc_ProductMark
+from services.bulk_upsert import (
+    delete_missing_products,
+    reconcile_children,
+    write_dictionaries,
+    write_product_dictionaries,
+    write_products_bulk,
+)
+from services.change_feed import record_product_changes
+from services.dictionary_cache import (
+    DictionaryCache,
+    savepoint,
+)
+from services.feed_merge import ProductDeduplicator
+from services.ingest_stats import count, phase, sampled
+from services.json_stream import iter_json_object_items
+from services.pg_copy import copy_supported, write_products_copy
+from settings import IngestWriter, cfg
+
+# Writes one batch of products, see ``BATCH_WRITERS``
+BatchWriter = Callable[[Session, list[sc_Product], DictionaryCache], None]
 
 logger: Logger = Logger(
     core=Core(),
@@ -44,34 +53,6 @@ logger: Logger = Logger(
     extra={}
 )
 
-@logger.catch
-def request_get_products_main_true() -> dict[str, Any]:
-    response: Response = Client().get(
-        url='https://bot-igor.ru/api/products?on_main=true',
-        headers={
-            'Accept': 'application/json'
-        }
-    )
-
-    if not response.status_code == 200:
-        HTTPStatusError('wrong status code')
-
-    return response.content
-
-@logger.catch
-def request_get_products_main_false() -> dict[str, Any]:
-    response: Response = Client().get(
-        url='https://bot-igor.ru/api/products?on_main=false',
-        headers={
-            'Accept': 'application/json'
-        }
-    )
-
-    if not response.status_code == 200:
-        HTTPStatusError('wrong status code')
-
-    return response.content
-
 def prepare_celery_app() -> Celery:
 
     level: str = 'DEBUG' if cfg.DEBUG else 'INFO'
@@ -83,334 +64,434 @@ def prepare_celery_app() -> Celery:
         sink='celery.log',
         level=level,
         format='{time} {level} {message}',
-        enqueue=True
+        enqueue=True,
+        **cfg.LOG_FILE_OPTIONS
     )
 
     register(logger.remove)
 
     app: Celery = Celery(
         main='celery_app',
-        broker=cfg.REDIS_URL
+        broker=cfg.REDIS_URL,
+        backend=cfg.REDIS_URL
     )
 
     app.logger: Logger = logger
 
     return app
 
-AlchemyEntity: TypeVar = TypeVar('AlchemyEntity')
-PydanticEntity: TypeVar = TypeVar('PydanticEntity')
-
-"""
-    Была использована функция, т.к. она нужна один раз для этого
-    задания и для этой ручки, эту пробему можно было бы решить
-    через классы адаптеры
-"""
-def update_or_create_product_entity(
+def create_or_update_product(
     session: Session,
-    table_cls: AlchemyEntity,
-    model_obj: PydanticEntity | str
-) -> AlchemyEntity | None:
+    product_data: sc_Product
+) -> Product:
+    """Write the product row through the ORM, related rows are synced for
+    the whole batch by ``reconcile_children``"""
     try:
+        product: Product = session.get_one(
+            entity=Product,
+            ident=product_data.id
+        )
 
-        try:
-            ident: int = model_obj.id
-
-            target_table_obj: AlchemyEntity = session.get_one(
-                entity=table_cls,
-                ident=ident
-            )
-
-            target_model_obj: PydanticEntity = model_obj.__class__.from_orm(
-                target_table_obj
-            )
-
-            if target_model_obj != model_obj and not isinstance(model_obj, str):
-                for attr_name, attr_value in model_obj.dict().items():
-                    setattr(target_model_obj, attr_name, attr_value)
-                    logger.debug(
-                        f'At element {
-                            target_model_obj.__repr__()
-                        } attribute {attr_name} was changed to {attr_value}'
-                    )
-
-        except AttributeError as e:
-            if not isinstance(model_obj, str) and not isinstance(table_cls, Tag):
-                raise e
-            # for Tags table model
-            stmt: Select = select(table_cls).where(
-                Tag.name == model_obj
-            )
-
-            target_result: IteratorResult = session.execute(
-                statement=stmt
+        count('products_updated')
+        if sampled():
+            logger.opt(lazy=True).debug(
+                'Product schema {}',
+                product_data.__repr__
             )
 
-            target_table_obj: AlchemyEntity = target_result.scalar_one()
-
-    except NoResultFound:
-        try:
-            target_table_obj: AlchemyEntity = table_cls(**model_obj.dict())
-        except AttributeError as e:
-            if not isinstance(model_obj, str):
-                raise e
-            # for Tags table model
-            target_table_obj: AlchemyEntity = table_cls(name=model_obj)
-        session.add(
-            target_table_obj,
+        product.on_main = product_data.on_main
+        product.name = product_data.name
+        product.updated_at = product_data.updated_at
+        product.moysklad_connector_products_data = (
+            product_data.moysklad_connector_products_data
         )
-
-        logger.debug(
-            f'Table object {target_table_obj.__repr__()} successful added'
+        product.content_hash = product_data.content_hash
+    except NoResultFound:
+        product: Product = Product(
+            id=product_data.id,
+            created_at=product_data.created_at,
+            on_main=product_data.on_main,
+            name=product_data.name,
+            updated_at=product_data.updated_at,
+            moysklad_connector_products_data=product_data.moysklad_connector_products_data,
+            content_hash=product_data.content_hash
         )
+        session.add(product)
 
-        return target_table_obj
+        count('products_created')
 
-    return None
+    return product
 
-def run_update_or_create_for_product_list_entitys(
+def write_product_in_savepoint(
     session: Session,
-    root_table_obj: AlchemyEntity,
-    name_attribute_root: str,
-    table_cls: AlchemyEntity,
-    list_model_obj: list[PydanticEntity | str] | None
-):
+    product_data: sc_Product,
+    write: BatchWriter,
+    cache: DictionaryCache
+) -> bool:
     try:
-        attributes: list[AlchemyEntity] = getattr(
-            root_table_obj,
-            name_attribute_root
+        with savepoint(session, cache):
+            write(session, [product_data], cache)
+    except Exception as e:
+        count('products_failed')
+        logger.error(
+            'Product(id={}) skipped, savepoint rolled back: {}',
+            product_data.id,
+            e
         )
+        return False
 
-        try:
-            ids_actual: list[int] = [model_obj.id for model_obj in list_model_obj]
-        except AttributeError as e:
-            if not isinstance(list_model_obj[0], str):
-                raise e
-            ids_actual: list[AlchemyEntity] = [
-                attribute.id for attribute in attributes \
-                    if attribute.name in list_model_obj
-            ]
+    return True
 
-        for attribute in attributes:
-            if attribute.id not in ids_actual:
-                removed_attrivute: AlchemyEntity = attributes.pop(attribute)
-                for_logger_str: str = list_model_obj[0].__class__.from_orm(
-                    removed_attrivute
-                ).__repr__()
-                logger.debug(
-                    f'Attribute {for_logger_str} was removed'
-                )
 
+def same_moment(first: datetime | None, second: datetime | None) -> bool:
+    # SQLite gives back naive datetimes, the feed dates are always UTC
+    if first is None or second is None:
+        return first is second
+    if first.tzinfo is None:
+        first = first.replace(tzinfo=UTC)
+    if second.tzinfo is None:
+        second = second.replace(tzinfo=UTC)
+    return first == second
 
-        for model_obj_data in list_model_obj:
 
-            new_table_obj: AlchemyEntity = update_or_create_product_entity(
-                session=session,
-                table_cls=table_cls,
-                model_obj=model_obj_data
-            )
+def filter_changed_products(
+    session: Session,
+    products: list[sc_Product]
+) -> list[sc_Product]:
+    """Drop products whose ``updated_at`` and content hash equal the stored
+    ones, with one query for the whole batch and no ORM loading"""
+    stmt: Select = select(
+        Product.id,
+        Product.updated_at,
+        Product.content_hash
+    ).where(Product.id.in_([product.id for product in products]))
+
+    stored: dict[int, tuple[datetime | None, str | None]] = {
+        ident: (updated_at, content_hash)
+        for ident, updated_at, content_hash in session.execute(stmt)
+    }
+
+    changed: list[sc_Product] = []
+    for product_data in products:
+        updated_at, content_hash = stored.get(product_data.id, (None, None))
+        if content_hash is not None and same_moment(
+            updated_at, product_data.updated_at
+        ) and content_hash == product_data.content_hash:
+            continue
+        changed.append(product_data)
+
+    return changed
+
+
+def write_orm_batch(
+    session: Session,
+    products: list[sc_Product],
+    cache: DictionaryCache
+):
+    tag_ids: dict[str, int] = write_product_dictionaries(
+        session=session,
+        products=products,
+        cache=cache
+    )
 
-            if not isinstance(attributes, InstrumentedList):
-                raise TypeError(
-                    f'{table_cls.__repr__}.{name_attribute_root} is not list'
-                )
+    # one query puts the batch in the identity map for Session.get_one
+    session.scalars(
+        select(Product).where(
+            Product.id.in_([product_data.id for product_data in products])
+        )
+    ).all()
 
-            if new_table_obj is not None:
-                attributes.append(new_table_obj)
+    for product_data in products:
+        create_or_update_product(session, product_data)
 
-    except TypeError as e:
-        if list_model_obj is not None:
-            raise e
+    session.flush()
 
-def create_or_update_product(
+    reconcile_children(session, products, tag_ids)
+
+
+def write_bulk_batch(
     session: Session,
-    product_data: sc_Product
+    products: list[sc_Product],
+    cache: DictionaryCache
 ):
-    try:
-        product: Product = session.get_one(
-            entity=Product,
-            ident=product_data.id
-        )
+    write_products_bulk(session=session, products=products, cache=cache)
 
-        logger.info(f'Product with id={product_data.id} finded')
-        logger.debug(f'Product schema {product_data.__repr__()}')
 
-        product: Product = session.get_one(
-            entity=Product,
-            ident=product_data.id,
-            options=[
-                joinedload(Product.categories),
-                joinedload(Product.marks),
-                joinedload(Product.colors),
-                joinedload(Product.excluded),
-                joinedload(Product.images),
-                joinedload(Product.importance_num),
-                joinedload(Product.parameters),
-                joinedload(Product.extras),
-                joinedload(Product.reviews),
-                joinedload(Product.reviews_video),
-                joinedload(Product.tags)
-            ]
-        )
+def write_copy_batch(
+    session: Session,
+    products: list[sc_Product],
+    cache: DictionaryCache
+):
+    tag_ids: dict[str, int] = write_product_dictionaries(
+        session=session,
+        products=products,
+        cache=cache
+    )
+    write_products_copy(session, products, tag_ids)
 
-        logger.debug(f'Product model {product.__repr__()} full loaded')
-    except NoResultFound:
-        product: Product = Product(
-            id=product_data.id,
-            created_at=product_data.created_at,
-            on_main=product_data.on_main,
-            name=product_data.name,
-            updated_at=product_data.updated_at,
-            moysklad_connector_products_data=product_data.moysklad_connector_products_data
-        )
-        session.add(product)
 
-        logger.info(f'Product model {product.__repr__()} added in session')
+BATCH_WRITERS: dict[IngestWriter, BatchWriter] = {
+    IngestWriter.BULK: write_bulk_batch,
+    IngestWriter.ORM: write_orm_batch,
+    IngestWriter.COPY: write_copy_batch,
+}
 
-    # if product.updated_at == product_data.updated_at:
-    #     return
 
-    # Create related entities and relationships
-    # Categories
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='categories',
-        table_cls=Category,
-        list_model_obj=product_data.categories
-    )
+def batch_writer(session: Session) -> BatchWriter:
+    writer: IngestWriter = cfg.INGEST_WRITER
 
-    logger.debug(f'Product(id={product.id}) categories succeseful readed')
+    # COPY is PostgreSQL only, other databases use the generic bulk path
+    if writer == IngestWriter.COPY and not copy_supported(session):
+        logger.warning('COPY needs PostgreSQL with psycopg2, bulk writer used')
+        writer = IngestWriter.BULK
 
-    # ProductMark
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='marks',
-        table_cls=ProductMark,
-        list_model_obj=product_data.marks
-    )
+    return BATCH_WRITERS[writer]
 
-    logger.debug(f'Product(id={product.id}) marks succeseful readed')
 
-    # Colors
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='colors',
-        table_cls=Color,
-        list_model_obj=product_data.colors
-    )
+def write_products(
+    session: Session,
+    products: Iterable[sc_Product],
+    categories: Iterable[sc_Category] = (),
+    product_marks: Iterable[sc_ProductMark] = (),
+    cache: DictionaryCache | None = None,
+    skip_batches: int = 0,
+    batch_written: Callable[[int], Any] | None = None
+):
+    """Write products by ``cfg.INGEST_BATCH_SIZE`` per transaction.
 
-    logger.debug(f'Product(id={product.id}) colors succeseful readed')
+    A batch is written in one savepoint, if it fails the batch is
+    replayed product by product, so a bad product loses only its own
+    savepoint and the rest of the batch is committed.
 
-    # Extras
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='extras',
-        table_cls=Extra,
-        list_model_obj=product_data.extras
-    )
+    The first ``skip_batches`` batches were committed by an interrupted
+    run and are not written again. ``batch_written`` gets the number of
+    batches done after every commit.
+    """
+    if cache is None:
+        cache: DictionaryCache = DictionaryCache.preload(session)
 
-    logger.debug(f'Product(id={product.id}) extras succeseful readed')
+    write_dictionaries(session, categories, product_marks, cache)
 
-    # Images
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='images',
-        table_cls=Image,
-        list_model_obj=product_data.images
-    )
+    write: BatchWriter = batch_writer(session)
 
-    logger.debug(f'Product(id={product.id}) images succeseful readed')
+    for number, batch in enumerate(
+        batched(products, cfg.INGEST_BATCH_SIZE),
+        start=1
+    ):
+        if number <= skip_batches:
+            count('batches_skipped')
+            continue
 
-    # Parameters
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='parameters',
-        table_cls=Parameter,
-        list_model_obj=product_data.parameters
-    )
+        write_batch(session, list(batch), write, cache)
 
-    logger.debug(f'Product(id={product.id}) parameters succeseful readed')
+        if batch_written is not None:
+            batch_written(number)
 
-    # Reviews
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='reviews',
-        table_cls=Review,
-        list_model_obj=product_data.reviews
+    # dictionaries changed without any product, or streamed after the
+    # last batch, are not committed by write_batch
+    session.commit()
+
+def write_batch(
+    session: Session,
+    batch: list[sc_Product],
+    write: BatchWriter,
+    cache: DictionaryCache
+):
+    """Write and commit one batch of ``write_products``"""
+    # the last version of a product repeated in the batch wins
+    unique: list[sc_Product] = list(
+        {product.id: product for product in batch}.values()
     )
 
-    logger.debug(f'Product(id={product.id}) reviews succeseful readed')
+    with phase('filter'):
+        batch = filter_changed_products(session=session, products=unique)
 
-    # Review Videos
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='reviews_video',
-        table_cls=ReviewVideo,
-        list_model_obj=product_data.reviews_video
-    )
+    count('products_unchanged', len(unique) - len(batch))
 
-    logger.debug(f'Product(id={product.id}) reviews_video succeseful readed')
+    if not batch:
+        return
 
-    # Excluded Items
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='excluded',
-        table_cls=ExcludedItem,
-        list_model_obj=product_data.excluded
+    with phase('write'):
+        try:
+            with savepoint(session, cache):
+                write(session, batch, cache)
+        except Exception as e:
+            logger.warning('Batch failed, retry by one product: {}', e)
+            batch = [
+                product_data for product_data in batch
+                if write_product_in_savepoint(session, product_data, write, cache)
+            ]
+
+        record_product_changes(session, [product.id for product in batch])
+
+    with phase('commit'):
+        session.commit()
+        session.expunge_all()
+
+    count('batches')
+    count('products_written', len(batch))
+
+    logger.debug('Batch of {} products commited', len(batch))
+
+def iter_stream_entities(
+    chunks: Iterable[bytes],
+    deduplicator: ProductDeduplicator,
+    feed_ids: set[int]
+) -> Iterator[tuple[str, Any]]:
+    """Validate a feed read from ``chunks`` entity by entity, yields
+    ``('products', product)`` and whole ``categories``/``product_marks``
+    lists as soon as they are read.
+    Products losing the merge against an already seen version are dropped.
+
+    Ids of all products read, invalid ones included, are added to
+    ``feed_ids``.
+    """
+    items: Iterator[tuple[str, Any]] = iter_json_object_items(
+        chunks=chunks,
+        stream_keys=('products', )
     )
 
-    logger.debug(f'Product(id={product.id}) excluded succeseful readed')
+    for key, value in items:
+        if key == 'products':
+            count('products_read')
+            if isinstance(value.get('Product_ID'), int):
+                feed_ids.add(value['Product_ID'])
 
-    # Importance Numbers
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='importance_num',
-        table_cls=ImportanceNum,
-        list_model_obj=product_data.importance_num
-    )
+            try:
+                product_data: sc_Product = sc_Product.model_validate(
+                    value,
+                    by_alias=True
+                )
+            except ValidationError as e:
+                count('products_invalid')
+                logger.error('Product {} skipped: {}', value.get('Product_ID'), e)
+                continue
+
+            if sampled():
+                logger.opt(lazy=True).debug(
+                    'Product schema {}',
+                    product_data.__repr__
+                )
 
-    logger.debug(f'Product(id={product.id}) importance_num succeseful readed')
+            if deduplicator.accept(product_data):
+                yield key, product_data
+            else:
+                count('products_superseded')
+        elif key == 'categories':
+            yield key, [
+                sc_Category.model_validate(category, by_alias=True)
+                for category in value
+            ]
+        elif key == 'product_marks':
+            yield key, [
+                sc_ProductMark.model_validate(mark, by_alias=True)
+                for mark in value
+            ]
 
-    # Tags
-    run_update_or_create_for_product_list_entitys(
-        session=session,
-        root_table_obj=product,
-        name_attribute_root='tags',
-        table_cls=Tag,
-        list_model_obj=product_data.tags
-    )
+def iter_stream_products(
+    session: Session,
+    chunks: Iterable[bytes],
+    deduplicator: ProductDeduplicator,
+    cache: DictionaryCache,
+    feed_ids: set[int]
+) -> Iterator[sc_Product]:
+    """Products of a streamed feed, top-level dictionaries are written as
+    soon as they are read"""
+    for key, value in iter_stream_entities(chunks, deduplicator, feed_ids):
+        if key == 'products':
+            yield value
+        elif key == 'categories':
+            write_dictionaries(session, value, (), cache)
+        elif key == 'product_marks':
+            write_dictionaries(session, (), value, cache)
+
+def remove_missing_products(session: Session, product_ids: Collection[int]):
+    """Delete products that are gone from the feeds, ``product_ids`` must
+    hold every product of all merged feeds"""
+    if not cfg.INGEST_DELETE_MISSING:
+        return
+
+    with phase('delete'):
+        deleted: int = delete_missing_products(session, product_ids)
+        session.commit()
+
+    count('products_deleted', deleted)
+
+@logger.catch
+def database_delete_missing_products(product_ids: Collection[int]) -> bool:
+    with sync_session_maker() as session:
+        remove_missing_products(session, product_ids)
 
-    logger.debug(f'Product(id={product.id}) importance_num succeseful readed')
+    return True
 
-    session.commit()
+@logger.catch
+def database_write_update_stream(feeds_chunks: Iterable[Iterable[bytes]]) -> bool:
+    deduplicator: ProductDeduplicator = ProductDeduplicator()
+    feed_ids: set[int] = set()
+
+    with sync_session_maker() as session:
+        cache: DictionaryCache = DictionaryCache.preload(session)
+        write_products(
+            session=session,
+            products=chain.from_iterable(
+                iter_stream_products(
+                    session,
+                    chunks,
+                    deduplicator,
+                    cache,
+                    feed_ids
+                ) for chunks in feeds_chunks
+            ),
+            cache=cache
+        )
+        remove_missing_products(session, feed_ids)
 
-    logger.info(f'Product(id={product.id}) succesesful update or added')
+    return True
 
 @logger.catch
-def database_write_update_on_main(model: OnMainRootModel):
-    session: Session = sync_session_maker()
+def database_write_dictionaries(model: OnMainRootModel) -> bool:
+    """Write categories, product marks and tags of the whole feed in one
+    transaction, before product shards are written in parallel"""
+    with sync_session_maker() as session:
+        write_product_dictionaries(
+            session=session,
+            products=model.products,
+            categories=model.categories,
+            product_marks=model.product_marks,
+            cache=DictionaryCache.preload(session)
+        )
+        session.commit()
 
-    # Create or update products
-    for product_data in model.products:
-        create_or_update_product(session, product_data)
+    return True
 
-    session.commit()
+@logger.catch
+def database_write_update_products(products: list[sc_Product]) -> bool:
+    with sync_session_maker() as session:
+        write_products(session=session, products=products)
+
+    return True
 
 @logger.catch
-def database_write_update_not_main(model: RootModel):
-    session: Session = sync_session_maker()
+def database_write_update_on_main(
+    model: OnMainRootModel,
+    skip_batches: int = 0,
+    batch_written: Callable[[int], Any] | None = None
+) -> bool:
+    with sync_session_maker() as session:
+        write_products(
+            session=session,
+            products=model.products,
+            categories=model.categories,
+            product_marks=model.product_marks,
+            skip_batches=skip_batches,
+            batch_written=batch_written
+        )
 
-    # Create or update products
-    for product_data in model.products:
-        create_or_update_product(session, product_data)
+    return True
 
-    session.commit()
+@logger.catch
+def database_write_update_not_main(model: RootModel) -> bool:
+    with sync_session_maker() as session:
+        write_products(session=session, products=model.products)
+
+    return True
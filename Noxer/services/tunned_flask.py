@@ -1,13 +1,19 @@
+from asyncio import AbstractEventLoop, new_event_loop, run_coroutine_threadsafe
 from atexit import register
-from collections.abc import AsyncGenerator, Generator
+from collections.abc import AsyncGenerator, Callable, Coroutine, Generator
 from contextlib import asynccontextmanager
+from functools import wraps
+from os import getpid
 from sys import stderr
+from threading import Lock, Thread, main_thread
+from typing import Any
 
 from flask import Flask
 from flask.app import App
 from flask.logging import default_handler
 from loguru._defaults import LOGURU_AUTOINIT
 from loguru._logger import Core, Logger
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -15,10 +21,16 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool, QueuePool
 from werkzeug.utils import cached_property
 
-from database import sync_session_maker
-from settings import cfg
+from database import enable_sqlite_foreign_keys, sync_session_maker
+from services.response_cache import LocalResponseCache
+from settings import DatabaseType, cfg
+
+# How often the loop thread of the views checks whether the main thread
+# is done
+MAIN_THREAD_POLL_SECONDS: float = 0.5
 
 
 def create_logger(app: App) -> Logger:
@@ -58,7 +70,8 @@ def create_logger(app: App) -> Logger:
         sink='test.log',
         level='INFO',
         format='{time} {level} {message}',
-        enqueue=True
+        enqueue=True,
+        **cfg.LOG_FILE_OPTIONS
     )
 
     register(logger.remove)
@@ -67,28 +80,185 @@ def create_logger(app: App) -> Logger:
 
 
 class TunnedFlask(Flask):
-    """My Solution with loguru for logs & sqlalchemy"""
+    """My Solution with loguru for logs & sqlalchemy.
+
+    Async views of a worker run on one event loop thread of the worker,
+    so the async engine and its connection pool are created once and
+    shared by every request instead of being built for each one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.database_lock: Lock = Lock()
+        self.database_pid: int | None = None
+        self.event_loop: AbstractEventLoop | None = None
+        self.event_loop_thread: Thread | None = None
+        self.async_engine: AsyncEngine | None = None
+        self.async_session_maker: async_sessionmaker | None = None
+        self.redis: Redis | None = None
+        self.response_cache: LocalResponseCache = LocalResponseCache(
+            maxsize=cfg.RESPONSE_CACHE_LOCAL_SIZE,
+            ttl=cfg.RESPONSE_CACHE_LOCAL_TTL
+        )
 
     @cached_property
     def logger(self) -> Logger:
         return create_logger(self)
 
+    def start_database(
+        self,
+        event_loop: AbstractEventLoop | None = None
+    ) -> AbstractEventLoop:
+        """Event loop, async engine and Redis client of this process,
+        created on the first call after the fork (gunicorn
+        ``post_worker_init``).
+
+        The views run on ``event_loop`` if given, the loop of an ASGI
+        server, otherwise on a loop thread of the app.
+        """
+        if self.database_pid == getpid():
+            return self.event_loop
+
+        with self.database_lock:
+            if self.database_pid == getpid():
+                return self.event_loop
+
+            # a forked worker never reuses the loop or the connections
+            # of its parent
+            if event_loop is None:
+                event_loop = new_event_loop()
+                self.event_loop_thread = Thread(
+                    target=self.run_event_loop,
+                    args=(event_loop, ),
+                    name='async-views'
+                )
+                self.event_loop_thread.start()
+            self.event_loop = event_loop
+
+            self.async_engine = create_async_engine(
+                url = cfg.DATABASE_URL_ASYNC_ENGINE,
+                **cfg.DB_POOL_OPTIONS
+            )
+            if cfg.DB_TYPE == DatabaseType.SQLITE:
+                enable_sqlite_foreign_keys(self.async_engine.sync_engine)
+            self.async_session_maker = async_sessionmaker(
+                bind=self.async_engine,
+                expire_on_commit=False
+            )
+            if cfg.RESPONSE_CACHE:
+                # response cache shared by all the workers
+                self.redis = Redis.from_url(
+                    url=cfg.REDIS_URL,
+                    decode_responses=True,
+                    socket_timeout=cfg.HTTP_CONNECT_TIMEOUT
+                )
+            self.database_pid = getpid()
+
+            return self.event_loop
+
+    def run_event_loop(self, event_loop: AbstractEventLoop):
+        """Loop thread of the views. Not a daemon: once the main thread
+        is done it disposes the engine itself, the aiosqlite thread of
+        every pooled connection would keep the interpreter alive
+        otherwise."""
+        event_loop.call_soon(self.watch_main_thread, event_loop)
+        event_loop.run_forever()
+        event_loop.close()
+
+    def watch_main_thread(self, event_loop: AbstractEventLoop):
+        if main_thread().is_alive():
+            event_loop.call_later(
+                MAIN_THREAD_POLL_SECONDS,
+                self.watch_main_thread,
+                event_loop
+            )
+            return
+
+        event_loop.create_task(self.stop_event_loop(event_loop))
+
+    async def stop_event_loop(self, event_loop: AbstractEventLoop):
+        await self.dispose_database()
+        event_loop.stop()
+
+    async def dispose_database(self):
+        """Close the pooled connections, awaited on the event loop of the
+        views (ASGI lifespan shutdown)"""
+        if self.database_pid != getpid():
+            return
+
+        async_engine: AsyncEngine = self.async_engine
+        redis: Redis | None = self.redis
+        self.logger.info(f'Async engine disposed, pool: {self.pool_status()}')
+
+        self.database_pid = None
+        self.event_loop = None
+        self.event_loop_thread = None
+        self.async_engine = None
+        self.async_session_maker = None
+        self.redis = None
+
+        await async_engine.dispose()
+        if redis is not None:
+            await redis.aclose()
+
+    def stop_database(self):
+        """Close the pooled connections and stop the loop thread, gunicorn
+        ``worker_exit`` calls it, a plain process leaves it to the loop
+        thread"""
+        with self.database_lock:
+            if self.database_pid != getpid() or self.event_loop_thread is None:
+                # an ASGI server disposes the engine on its own loop
+                return
+
+            event_loop: AbstractEventLoop = self.event_loop
+            event_loop_thread: Thread = self.event_loop_thread
+            run_coroutine_threadsafe(self.dispose_database(), event_loop).result()
+
+            event_loop.call_soon_threadsafe(event_loop.stop)
+            event_loop_thread.join()
+
+    def pool_status(self) -> dict[str, int | str | None]:
+        """Connection pool counters of this worker"""
+        pool: Pool | None = self.async_engine.pool if self.async_engine \
+            else None
+        status: dict[str, int | str | None] = {
+            'pid': getpid(),
+            'pool': type(pool).__name__ if pool else None,
+        }
+        if isinstance(pool, QueuePool):
+            status.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return status
+
+    def async_to_sync(
+        self,
+        func: Callable[..., Coroutine]
+    ) -> Callable[..., Any]:
+        """Async views run on the event loop of the worker, not on a new
+        loop per request: pooled connections are bound to their loop.
+        The request context goes along with the contextvars."""
+        @wraps(func)
+        def run(*args, **kwargs) -> Any:
+            return run_coroutine_threadsafe(
+                func(*args, **kwargs),
+                self.start_database()
+            ).result()
+
+        return run
+
     @staticmethod
     def get_sync_session() -> Generator[Session]:
         with sync_session_maker as session:
             yield session
 
-    @staticmethod
     @asynccontextmanager
-    async def get_async_session() -> AsyncGenerator[AsyncSession]:
-        async_engine: AsyncEngine = create_async_engine(
-            url = cfg.DATABASE_URL_ASYNC_ENGINE
-        )
-        async_session_maker: async_sessionmaker = async_sessionmaker(
-            bind=async_engine,
-            expire_on_commit=False
-        )
-        async with async_session_maker() as session:
+    async def get_async_session(self) -> AsyncGenerator[AsyncSession]:
+        self.start_database()
+        async with self.async_session_maker() as session:
             try:
                 yield session
             except Exception as e:
@@ -32,12 +32,74 @@ class DatabaseType(Enum):
         return sync_driver_dict.get(self.value)
 
 
+class IngestWriter(Enum):
+    BULK: str = "bulk"
+    ORM: str = "orm"
+    COPY: str = "copy"
+
+
 class MainCFG(BaseSettings):
     DEBUG: bool = True
     DB_TYPE: DatabaseType
     DB_PATH: str
     UPDATE_HOURS: int
     REDIS_URL: str
+    INGEST_WRITER: IngestWriter = IngestWriter.BULK
+    INGEST_BATCH_SIZE: int = 200
+    INGEST_STREAMING: bool = False
+    INGEST_STREAM_CHUNK_SIZE: int = 64 * 1024
+    INGEST_ASYNC: bool = False
+    INGEST_PIPELINE_DEPTH: int = 2
+    INGEST_SHARDS: int = 1
+    INGEST_DELETE_MISSING: bool = True
+    INGEST_CHECKPOINTS: bool = True
+    INGEST_CHECKPOINT_TTL: int = 24 * 60 * 60
+    PAYLOAD_CACHE: bool = True
+    PAYLOAD_CACHE_DIR: str = 'payloads'
+    PRODUCTS_API_URL: str = 'https://bot-igor.ru/api/products'
+    HTTP_TIMEOUT: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_MAX_CONNECTIONS: int = 10
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    LOG_ROTATION: str = '50 MB'
+    LOG_RETENTION: str = '14 days'
+    LOG_COMPRESSION: str = 'gz'
+    LOG_BUFFER_SIZE: int = 64 * 1024
+    LOG_SAMPLE_RATE: float = 0.0
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_STATUS: bool = False
+    ASGI_THREADS: int = 32
+    RESPONSE_CACHE: bool = True
+    RESPONSE_CACHE_TTL: int = 60 * 60
+    RESPONSE_CACHE_LOCAL_SIZE: int = 256
+    RESPONSE_CACHE_LOCAL_TTL: float = 5.0
+
+    @property
+    def LOG_FILE_OPTIONS(self):
+        # loguru file sink: rotated, compressed, written by LOG_BUFFER_SIZE
+        options: dict = {
+            "rotation": self.LOG_ROTATION,
+            "retention": self.LOG_RETENTION,
+            "compression": self.LOG_COMPRESSION,
+            "buffering": self.LOG_BUFFER_SIZE,
+        }
+        return options
+
+    @property
+    def DB_POOL_OPTIONS(self):
+        # pool of the web tier async engine, one per worker
+        options: dict = {
+            "pool_size": self.DB_POOL_SIZE,
+            "max_overflow": self.DB_MAX_OVERFLOW,
+            "pool_timeout": self.DB_POOL_TIMEOUT,
+            "pool_recycle": self.DB_POOL_RECYCLE,
+            "pool_pre_ping": self.DB_POOL_PRE_PING,
+        }
+        return options
 
     @property
     def DATABASE_URL_SYNC_ENGINE(self):
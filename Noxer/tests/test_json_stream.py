@@ -0,0 +1,61 @@
+import json
+import unittest
+from json import JSONDecodeError
+
+from services.json_stream import iter_json_object_items
+
+DOCUMENT: bytes = json.dumps(
+    {
+        'status': 'ok',
+        'products': [
+            {'id': 1, 'name': 'Наушники', 'price': -2.5e-3},
+            {'id': 2, 'name': 'Колонка ♪', 'price': 10.25},
+        ],
+        'categories': [{'id': 3, 'name': 'Техника'}],
+    },
+    ensure_ascii=False
+).encode()
+
+
+def read(chunks: list[bytes]) -> list[tuple[str, object]]:
+    return list(iter_json_object_items(chunks, ('products', 'categories')))
+
+
+def splits(body: bytes) -> list[list[bytes]]:
+    """``body`` in one chunk and cut in two at every byte"""
+    return [[body]] + [[body[:i], body[i:]] for i in range(1, len(body))]
+
+
+class JsonStreamTests(unittest.TestCase):
+
+    def test_any_chunk_split_reads_the_same_items(self):
+        expected: list[tuple[str, object]] = read([DOCUMENT])
+
+        for chunks in splits(DOCUMENT):
+            with self.subTest(chunks=chunks):
+                self.assertEqual(read(chunks), expected)
+
+    def test_truncated_body_raises_json_decode_error(self):
+        for end in range(len(DOCUMENT)):
+            for chunks in splits(DOCUMENT[:end]):
+                with self.subTest(end=end, chunks=chunks):
+                    with self.assertRaises(JSONDecodeError):
+                        read(chunks)
+
+    def test_body_cut_inside_multibyte_character(self):
+        end: int = DOCUMENT.index('Наушники'.encode()) + 1
+
+        with self.assertRaisesRegex(JSONDecodeError, f'byte {end - 1}'):
+            read([DOCUMENT[:end]])
+
+    def test_invalid_utf8_raises_json_decode_error(self):
+        body: bytes = DOCUMENT.replace('♪'.encode(), b'\xff')
+
+        for chunks in splits(body):
+            with self.subTest(chunks=chunks):
+                with self.assertRaises(JSONDecodeError):
+                    read(chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()